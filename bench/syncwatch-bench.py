@@ -0,0 +1,545 @@
+#!/usr/bin/python3
+
+# -*- coding: utf-8 -*-
+#########################################################
+# SERVICE : syncwatch-bench.py                          #
+#           Benchmarks for the syncwatch-cli config     #
+#           engine                                      #
+#           I. Helwegen 2020                            #
+#########################################################
+
+####################### IMPORTS #########################
+import sys
+import os
+import io
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import contextlib
+import subprocess
+import importlib.util
+import xml.etree.ElementTree as ET
+from xml.dom.minidom import parseString
+
+#########################################################
+
+####################### GLOBALS #########################
+CLIPATH      = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "opt", "syncwatch", "syncwatch-cli.py")
+ENCODING     = 'utf-8'
+STARTUPARGS  = [["--version"], ["--help"]]
+HEAVYMODULES = ["xml.etree.ElementTree", "xml.dom.minidom", "json", "subprocess", "socketserver",
+                "concurrent.futures", "tempfile", "ctypes", "dbus"]
+SUITECOUNTS  = [10, 1000, 10000, 50000]
+SUITEREPEAT  = 3
+FAKESYSTEMCTL = """#!/bin/sh
+# stand-in for systemctl, unit can reload and every action succeeds
+case "$1" in
+    show) echo yes ;;
+esac
+exit 0
+"""
+RUNNER       = """import sys, importlib.util
+spec = importlib.util.spec_from_file_location("swcli", sys.argv[1])
+cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cli)
+for patch in sys.argv[2].split(","):
+    name, path = patch.split("=", 1)
+    setattr(cli, name, path)
+cli.systemdbus.available = lambda self: False
+cli.swcli().run([sys.argv[1]] + sys.argv[3:])
+"""
+RSSENV       = "SWBENCH_RSS"
+RSSRUNNER    = """import os, atexit
+def peak():
+    # VmHWM is per address space, the rusage of a child also counts the bench before exec
+    with open("/proc/self/status") as status_file:
+        rss = [line.split()[1] for line in status_file if line.startswith("VmHWM:")]
+    with open(os.environ["{}"], "w") as rss_file:
+        rss_file.write(rss[0])
+atexit.register(peak)
+""".format(RSSENV) + RUNNER
+SCHEDULECONCURRENCY = [0, 4, 16]
+LOGLINE      = "{} - syncwatch - {} - {}: {}\n"
+LOGCYCLES    = 20
+COMMENT      = ("This XML file describes the synchronizations to be done.\n"
+                "            Add a sync to syncs to add a synchronization.")
+#########################################################
+
+###################### FUNCTIONS ########################
+
+def loadCli():
+    spec = importlib.util.spec_from_file_location("swcli", CLIPATH)
+    cli = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cli)
+    return cli
+
+def bareDatabase(cli):
+    # database without loading /etc/syncwatch.xml
+    db = cli.database.__new__(cli.database)
+    db.db = {}
+    db.settings = {}
+    db.comments = {}
+    db.duplicates = []
+    db.typeErrors = []
+    db.index = {}
+    db.spans = None
+    db.spanClose = 0
+    db.dirty = {}
+    db.settingsDirty = False
+    db.stamp = None
+    db.lockFile = None
+    db.lockWait = 0.0
+    return db
+
+def buildJobs(cli, count):
+    db = {}
+    for i in range(count):
+        item = cli.swcli().buildDefault()
+        item['source'] = "/data/source/{}".format(i)
+        item['destination'] = "/data/backup/{}".format(i)
+        item['exclude'] = "*.tmp,*.part" if i % 3 == 0 else ""
+        item['options'] = "--chmod=u+rw & <fast>" if i % 7 == 0 else ""
+        item['delay'] = i % 60
+        db["sync{}".format(i)] = item
+    return db
+
+def writeLog(path, count, first, cycles):
+    # every job syncs in 1 to 5 s, every third sync fails and is retried
+    stamp = 1600000000 + first * 60
+    with open(path, "a") as log_file:
+        for cycle in range(first, first + cycles):
+            for job in range(count):
+                name = "sync{}".format(job)
+                start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp))
+                end = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp + job % 5 + 1))
+                log_file.write(LOGLINE.format(start + ",000", "INFO", name, "Sync started"))
+                if cycle % 3 == 2:
+                    log_file.write(LOGLINE.format(end + ",500", "ERROR", name, "Sync failed, retrying"))
+                else:
+                    log_file.write(LOGLINE.format(end + ",500", "INFO", name, "Sync finished"))
+            stamp += 60
+
+def simulate(cli, jobs, maxconcurrent):
+    """Burst of all jobs at time 0, at most maxconcurrent syncs run (0 is no
+       limit). Waiting jobs start by ioclass, then highest priority, then in
+       order; idle jobs only start when no other job runs or waits.
+    """
+    import heapq
+    waiting = []
+    for order, (name, item, duration) in enumerate(jobs):
+        rank = cli.IOCLASSES.index(item['ioclass'])
+        heapq.heappush(waiting, (rank, -item['priority'], order, duration, item['priority'], item['ioclass']))
+    running = []
+    busy = 0 # running jobs that are not idle
+    now = 0
+    peak = 0
+    waits = {}
+    while waiting or running:
+        while waiting and (not maxconcurrent or len(running) < maxconcurrent):
+            if waiting[0][5] == "idle" and busy:
+                break
+            rank, precedence, order, duration, priority, ioclass = heapq.heappop(waiting)
+            waits.setdefault(("priority", priority), []).append(now)
+            waits.setdefault(("ioclass", ioclass), []).append(now)
+            waits.setdefault(("all", ""), []).append(now)
+            heapq.heappush(running, (now + duration, ioclass))
+            busy += ioclass != "idle"
+        peak = max(peak, len(running))
+        now, ioclass = heapq.heappop(running)
+        busy -= ioclass != "idle"
+    result = {}
+    result['maxconcurrent'] = maxconcurrent
+    result['makespan_s'] = now
+    result['peak_running'] = peak
+    result['wait_s'] = percentiles(waits[("all", "")])
+    result['wait_p90_by_priority'] = {str(key[1]): percentiles(value)['p90'] for key, value in sorted(waits.items()) if key[0] == "priority"}
+    result['wait_p90_by_ioclass'] = {key[1]: percentiles(value)['p90'] for key, value in waits.items() if key[0] == "ioclass"}
+    return result
+
+def percentiles(values):
+    ordered = sorted(values)
+    result = {}
+    for percentile in [50, 90]:
+        result["p{}".format(percentile)] = ordered[max(-(-percentile * len(ordered) // 100) - 1, 0)]
+    result['max'] = ordered[-1]
+    return result
+
+def standinPaths(root):
+    # stand-in locations instead of /etc, /var/cache and /run
+    paths = {}
+    paths['ETCPATH'] = os.path.join(root, "etc") + os.sep
+    paths['CACHEPATH'] = os.path.join(root, "cache")
+    paths['LOCKPATH'] = os.path.join(root, "lock")
+    paths['DELTAPATH'] = os.path.join(root, "run")
+    return paths
+
+def patchCli(cli, root):
+    for name, path in standinPaths(root).items():
+        setattr(cli, name, path)
+    cli.systemdbus.available = lambda self: False # always use (fake) systemctl
+    return cli
+
+def measure(func):
+    # wall and cpu time of a call, then its tracemalloc peak in a second
+    # call as tracing slows it down
+    start = time.perf_counter()
+    cpu = time.process_time()
+    result = func()
+    phase = {}
+    phase['wall_s'] = round(time.perf_counter() - start, 6)
+    phase['cpu_s'] = round(time.process_time() - cpu, 6)
+    tracemalloc.start()
+    func()
+    phase['peak_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    tracemalloc.stop()
+    return phase, result
+
+def timeit(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, result
+
+#########################################################
+# Class : legacy                                        #
+#########################################################
+class legacy(object):
+    """Serializer as used by the former database.prettify, kept for comparison.
+    """
+    def __init__(self, cli):
+        self.db = bareDatabase(cli)
+
+    def serialize(self, db, comment):
+        root = ET.Element('syncs')
+        if comment:
+            root.append(ET.Comment(comment))
+        self.buildXML(root, db)
+        rough_string = ET.tostring(root, ENCODING)
+        reparsed = parseString(rough_string)
+        return reparsed.toprettyxml(indent="\t").replace('<?xml version="1.0" ?>','<?xml version="1.0" encoding="%s"?>' % ENCODING)
+
+    def buildXML(self, xmltree, item):
+        if isinstance(item, dict):
+            for key, value in item.items():
+                kid = ET.SubElement(xmltree, key)
+                self.buildXML(kid, value)
+        else:
+            xmltree.text = self.db.settype(item)
+
+    def getItem(self, db, name):
+        itemvals = {}
+
+        for item, value in db.items():
+            if name.strip() == item.strip():
+                itemvals = value
+                break
+
+        return itemvals
+
+#########################################################
+# Class : standin                                       #
+#########################################################
+class standin(object):
+    """Temporary root with etc, cache, lock and run folders, a synthetic
+       syncwatch.xml, the reload marker of a daemon that reads the delta
+       and a fake systemctl first in PATH.
+    """
+    def __init__(self, cli, count):
+        self.cli = cli
+        self.count = count
+        self.root = ""
+        self.path = ""
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix = "syncwatch-bench.")
+        for folder in ["etc", "cache", "lock", "run", "bin"]:
+            os.mkdir(os.path.join(self.root, folder))
+        systemctl = os.path.join(self.root, "bin", "systemctl")
+        with open(systemctl, "w") as systemctl_file:
+            systemctl_file.write(FAKESYSTEMCTL)
+        os.chmod(systemctl, 0o755)
+        open(os.path.join(self.root, "run", self.cli.DELTAREADY_FILENAME), "w").close()
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = os.path.join(self.root, "bin") + os.pathsep + self.path
+        patchCli(self.cli, self.root)
+        db = bareDatabase(self.cli)
+        with open(self.xmlPath(), "w") as xml_file:
+            db.writeXML(xml_file, buildJobs(self.cli, self.count), {"": [COMMENT]})
+        return self
+
+    def __exit__(self, *args):
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.root)
+
+    def xmlPath(self):
+        return os.path.join(self.root, "etc", "syncwatch.xml")
+
+    def clearCache(self):
+        for cache in os.listdir(os.path.join(self.root, "cache")):
+            os.remove(os.path.join(self.root, "cache", cache))
+
+    def runCli(self, args):
+        # end to end, in a new interpreter as the UI does
+        patches = ",".join("{}={}".format(name, path) for name, path in standinPaths(self.root).items())
+        cmd = [sys.executable, "-c", RSSRUNNER, CLIPATH, patches] + args
+        rsspath = os.path.join(self.root, "rss")
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+                                env = dict(os.environ, **{RSSENV: rsspath}))
+        # cpu of this child only, RUSAGE_CHILDREN sums all children
+        pid, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        result = {}
+        result['wall_s'] = round(wall, 6)
+        result['cpu_s'] = round(usage.ru_utime + usage.ru_stime, 6)
+        try:
+            with open(rsspath) as rss_file:
+                result['maxrss_kb'] = int(rss_file.read())
+            os.remove(rsspath)
+        except (OSError, ValueError):
+            result['maxrss_kb'] = None
+        result['returncode'] = proc.returncode
+        return result
+
+#########################################################
+# Class : swbench                                       #
+#########################################################
+class swbench(object):
+    def __init__(self):
+        self.name = ""
+        self.cli = loadCli()
+
+    def __str__(self):
+        return "{}: benchmarks for syncwatch-cli".format(self.name)
+
+    def run(self, argv):
+        self.name = os.path.basename(argv[0])
+        if len(argv) < 2 or argv[1] in ["-h", "--help"]:
+            self.printHelp()
+        elif argv[1] == "serialize":
+            self.serialize(self.getCounts(argv[2:], [100, 1000, 10000]))
+        elif argv[1] == "suite":
+            self.suite(self.getCounts(argv[2:], SUITECOUNTS))
+        elif argv[1] == "startup":
+            self.startup()
+        elif argv[1] == "lookup":
+            self.lookup(self.getCounts(argv[2:], [100, 1000, 10000]))
+        elif argv[1] == "schedule":
+            self.schedule(self.getCounts(argv[2:], [100, 1000]))
+        elif argv[1] == "stats":
+            self.stats(self.getCounts(argv[2:], [10, 1000, 10000]))
+        else:
+            self.printHelp()
+            sys.exit(1)
+
+    def printHelp(self):
+        print(self)
+        print("Usage:")
+        print("    {} {}".format(self.name, "<benchmark> [<number of jobs> ...]"))
+        print("    <benchmarks>")
+        print("        suite         : per phase and end to end timings and memory peaks on a stand-in")
+        print("                        /etc with a fake systemctl (default {} jobs)".format(", ".join(str(c) for c in SUITECOUNTS)))
+        print("        serialize     : single pass writer against ET.tostring + minidom")
+        print("        startup       : interpreter startup and imports of syncwatch-cli (-X importtime),")
+        print("                        fails when {} imports heavy modules".format(" or ".join(a[0] for a in STARTUPARGS)))
+        print("        lookup        : indexed job lookup against a linear scan, every job once")
+        print("        schedule      : simulates a burst of events starting every job at once with")
+        print("                        maxconcurrent {}, by priority and ioclass".format(", ".join(str(c) for c in SCHEDULECONCURRENCY)))
+        print("        stats         : reading a fixture log of {} syncs per job from the start, then".format(LOGCYCLES))
+        print("                        only one appended sync per job, fails on wrong counts")
+
+    def getCounts(self, args, default):
+        try:
+            counts = [int(arg) for arg in args]
+        except ValueError:
+            print("Invalid number of jobs")
+            sys.exit(1)
+        return counts if counts else default
+
+    def serialize(self, counts):
+        results = []
+        old = legacy(self.cli)
+        db = bareDatabase(self.cli)
+        for count in counts:
+            jobs = buildJobs(self.cli, count)
+            def writer():
+                xml_file = io.StringIO()
+                db.writeXML(xml_file, jobs, {"": [COMMENT]})
+                return xml_file.getvalue()
+            legacyTime, legacyXML = timeit(lambda: old.serialize(jobs, COMMENT), 3)
+            writerTime, writerXML = timeit(writer, 3)
+            result = {}
+            result['jobs'] = count
+            result['legacy_s'] = round(legacyTime, 6)
+            result['writer_s'] = round(writerTime, 6)
+            result['speedup'] = round(legacyTime / writerTime, 2)
+            result['identical'] = legacyXML == writerXML
+            results.append(result)
+        print(json.dumps(results))
+
+    def lookup(self, counts):
+        results = []
+        old = legacy(self.cli)
+        db = bareDatabase(self.cli)
+        for count in counts:
+            db.db = buildJobs(self.cli, count)
+            names = list(db.db.keys())
+            indexTime, index = timeit(db.buildIndex, 3)
+            legacyTime, found = timeit(lambda: [old.getItem(db.db, name) for name in names], 1)
+            lookupTime, found = timeit(lambda: [db.getItem(name) for name in names], 3)
+            result = {}
+            result['jobs'] = count
+            result['legacy_s'] = round(legacyTime, 6)
+            result['index_build_s'] = round(indexTime, 6)
+            result['lookup_s'] = round(lookupTime, 6)
+            result['speedup'] = round(legacyTime / (indexTime + lookupTime), 2)
+            results.append(result)
+        print(json.dumps(results))
+
+    def schedule(self, counts):
+        results = []
+        for count in counts:
+            # every job syncs in 1 to 60 s, priorities and ioclasses spread over the jobs
+            jobs = []
+            for i, (name, item) in enumerate(buildJobs(self.cli, count).items()):
+                item['priority'] = (i * 7 + i // 10) % (self.cli.PRIORITYMAX - self.cli.PRIORITYMIN + 1) + self.cli.PRIORITYMIN
+                item['ioclass'] = "idle" if i % 10 == 9 else "low" if i % 5 == 4 else "normal"
+                jobs.append((name, item, i * 7919 % 60 + 1))
+            result = {}
+            result['jobs'] = count
+            result['runs'] = [simulate(self.cli, jobs, maxconcurrent) for maxconcurrent in SCHEDULECONCURRENCY]
+            results.append(result)
+        print(json.dumps(results))
+
+    def stats(self, counts):
+        results = []
+        failed = False
+        for count in counts:
+            with standin(self.cli, 0) as root:
+                log = os.path.join(root.root, "syncwatch.log")
+                writeLog(log, count, 0, LOGCYCLES)
+                opt = json.dumps({"log": log})
+                result = {}
+                result['jobs'] = count
+                result['log_bytes'] = os.path.getsize(log)
+                result['full'] = root.runCli(["stats", opt])
+                writeLog(log, count, LOGCYCLES, 1)
+                result['incremental'] = root.runCli(["stats", opt])
+                result['query'] = root.runCli(["stats", opt])
+                store = self.cli.syncstats(log)
+                jobs = [store.query(name) for name in store.names()]
+                result['correct'] = len(jobs) == count and all(job['syncs'] == LOGCYCLES + 1 and
+                                    job['failures'] == (LOGCYCLES + 1) // 3 and job['retries'] == job['failures'] and
+                                    job['duration']['samples'] == LOGCYCLES + 1 for job in jobs)
+                failed = failed or not result['correct']
+                results.append(result)
+        print(json.dumps(results))
+        if failed:
+            sys.exit(1)
+
+    def suite(self, counts):
+        results = []
+        for count in counts:
+            with standin(self.cli, count) as root:
+                result = {}
+                result['jobs'] = count
+                result['xml_bytes'] = os.path.getsize(root.xmlPath())
+                result['phases'] = self.phases(root)
+                result['commands'] = self.commands(root)
+                results.append(result)
+        print(json.dumps(results))
+
+    def phases(self, root):
+        import xml.etree.ElementTree as ET
+        phases = {}
+        db = bareDatabase(self.cli)
+        parser = lambda: ET.parse(root.xmlPath(), ET.XMLParser(target = ET.TreeBuilder(insert_comments = True)))
+        phases['parse'], tree = measure(parser)
+        phases['typeconversion'], db.db = measure(lambda: db.parseKids(tree.getroot()))
+        db.comments = db.parseComments(tree.getroot())
+        db.buildIndex()
+        db.stamp = db.getStamp()
+        phases['cachesave'], result = measure(db.saveCache)
+        phases['cacheload'], result = measure(db.loadCache)
+        phases['lookup'], result = measure(lambda: [db.getItem(name) for name in list(db.db)])
+        def serialize():
+            xml_file = io.StringIO()
+            db.writeXML(xml_file, db.db, db.comments)
+            return xml_file
+        phases['serialize'], result = measure(serialize)
+        phases['write'], result = measure(db.updateXML)
+        with open(root.xmlPath(), "rb") as xml_file:
+            data = xml_file.read()
+        written = ET.fromstring(data)
+        phases['spans'], (db.spans, db.spanClose) = measure(lambda: db.parseSpans(data, written))
+        db.stamp = db.getStamp()
+        def patch():
+            name = next(iter(db.db))
+            item = db.getItem(name)
+            item['delay'] += 1
+            db.setItem(name, item)
+            db.updateXML()
+        phases['patch'], result = measure(patch)
+        sw = self.cli.swcli()
+        sw.name = "bench"
+        sw.db = db
+        sw.sctl = self.cli.systemdctl()
+        delta = sw.newDelta()
+        sw.addDelta(delta, "modified", next(iter(db.db), ""))
+        with contextlib.redirect_stdout(io.StringIO()):
+            phases['daemoncontrol'], result = measure(lambda: sw.apply(delta))
+        return phases
+
+    def commands(self, root):
+        commands = {}
+        name = "sync0"
+        root.clearCache()
+        commands['version'] = root.runCli(["--version"])
+        commands['lst_nocache'] = root.runCli(["lst"])
+        commands['lst'] = root.runCli(["lst"])
+        commands['shw'] = root.runCli(["shw", name])
+        commands['status'] = root.runCli(["status"])
+        commands['add'] = root.runCli(["add", name, json.dumps({"delay": 42})])
+        commands['add_unchanged'] = root.runCli(["add", name, json.dumps({"delay": 42})])
+        commands['del'] = root.runCli(["del", name])
+        return commands
+
+    def startup(self):
+        results = []
+        regression = False
+        for args in STARTUPARGS:
+            cmd = [sys.executable, "-X", "importtime", CLIPATH] + args
+            wall, out = timeit(lambda: subprocess.run(cmd, capture_output = True, text = True), 5)
+            imports = {}
+            toplevel = 0
+            for line in out.stderr.splitlines():
+                # import time: self [us] | cumulative | imported package, indented when nested
+                fields = line.split("|")
+                if line.startswith("import time:") and fields[1].strip().isdigit():
+                    imports[fields[2].strip()] = int(fields[1])
+                    if not fields[2][1:].startswith(" "):
+                        toplevel += int(fields[1])
+            heavy = [module for module in HEAVYMODULES if module in imports]
+            result = {}
+            result['args'] = args
+            result['wall_s'] = round(wall, 6)
+            result['imports'] = len(imports)
+            result['import_s'] = round(toplevel / 1e6, 6)
+            result['heavy'] = heavy
+            if heavy:
+                regression = True
+            results.append(result)
+        print(json.dumps(results))
+        if regression:
+            sys.exit(1)
+
+######################### MAIN ##########################
+if __name__ == "__main__":
+    swbench().run(sys.argv)
@@ -11,10 +11,10 @@
 ####################### IMPORTS #########################
 import sys
 import os
-import xml.etree.ElementTree as ET
-from xml.dom.minidom import parseString
-import json
-import subprocess
+import marshal
+import time
+# other modules are imported where used to keep startup fast, as the UI
+# starts this script for every action
 
 #########################################################
 
@@ -33,12 +33,215 @@ CTLDISABLE   = SYSTEMCTL + " disable"
 CTLSTATUS    = SYSTEMCTL + " status"
 CTLISACTIVE  = SYSTEMCTL + " is-active"
 CTLISENABLED = SYSTEMCTL + " is-enabled"
+CTLCANRELOAD = SYSTEMCTL + " show --property=CanReload --value"
+CTLLISTJOBS  = SYSTEMCTL + " list-jobs --no-legend --full"
+CTLNOBLOCK   = "--no-block"
+CTLJOBS      = ["start", "stop", "reload", "restart"]
+CTLTIMEOUTS  = {"start": 90, "stop": 90, "reload": 90, "restart": 180, "wait": 180}
+JOBPOLL      = 0.1
+ETCPATH      = "/etc/"
+DBUSSYSTEMD  = "org.freedesktop.systemd1"
+DBUSSYSTEMDPATH = "/org/freedesktop/systemd1"
+DBUSMANAGER  = DBUSSYSTEMD + ".Manager"
+DBUSUNIT     = DBUSSYSTEMD + ".Unit"
+DBUSJOB      = DBUSSYSTEMD + ".Job"
+DBUSPROPERTIES = "org.freedesktop.DBus.Properties"
+DBUSJOBPOLL  = 0.02
+DBUSJOBMETHODS = {"start": "StartUnit", "stop": "StopUnit", "reload": "ReloadUnit", "restart": "RestartUnit"}
+DBUSACTIVE   = ["active", "reloading"]
+DBUSJOBDONE  = ["done", "skipped"] # JobRemoved results that systemctl accepts
+DBUSENABLED  = ["enabled", "enabled-runtime", "static", "alias", "indirect", "generated", "transient"]
 XML_FILENAME = "syncwatch.xml"
+CACHEPATH    = "/var/cache/syncwatch"
+CACHE_FILENAME = "syncwatch.cache"
+CACHESTATS_FILENAME = "cachestats"
+CACHECOUNTERS = ["hits", "misses"] # fixed size counters in the stats file
+CACHECOUNTERSIZE = 8
+CACHEVERSION = 7
+ESTIMATE_FILENAME = "estimate.cache"
+ESTIMATEVERSION = 1
+ESTIMATETOP  = 5
+MAXWATCHES   = "/proc/sys/fs/inotify/max_user_watches"
+SHARESPATH   = "/shares"
+STATS_FILENAME = "stats.cache"
+STATSVERSION = 1
+STATSSAMPLES = 100
+STATSPERCENTILES = [50, 90, 99]
+LOCKPATH     = "/run/lock"
+LOCK_FILENAME = "syncwatch.lock"
+LOCKTIMEOUT  = 10
+LOCKRETRY    = 0.01
+DELTAPATH    = "/run/syncwatch"
+DELTA_FILENAME = "reload.json"
+DELTAREADY_FILENAME = "reload.ready" # published by a daemon that reads the delta
+DELTAKINDS   = ["added", "removed", "modified", "settings"]
+SPANTOKENS   = rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[?!][^>]*>|<(/?)([^\s/>]+)[^>]*?(/?)>'
+SPANJOB      = rb'<([^\s/>]+)[^>]*(?<!/)>(?:\s*(?:<!--.*?-->|<[^\s/>!?]+[^>]*/>|<([^\s/>!?]+)[^>]*>[^<]*</\2\s*>))*\s*</\1\s*>'
+JOBDEFAULTS  = {"enabled": True, "source": "", "destination": "", "delay": 10, "resettimer": True,
+                "initsync": False, "reversesync": False, "retry": False, "delete": True, "exclude": "",
+                "include": "", "compress": True, "update": True, "options": "", "priority": 5,
+                "ioclass": "normal"}
+JOBFIELDS    = {field: type(value) for field, value in JOBDEFAULTS.items()}
+COMPATFIELDS = ["enabled", "priority", "ioclass"] # not written by older versions
+PRIORITYMIN  = 0
+PRIORITYMAX  = 9
+IOCLASSES    = ["normal", "low", "idle"]
+SETTINGDEFAULTS = {"maxconcurrent": 0} # attributes of the root, 0 is no limit
+SETTINGFIELDS = {field: type(value) for field, value in SETTINGDEFAULTS.items()}
+LSTFIELDS    = ["enabled", "source", "destination", "reversesync", "delete", "priority", "ioclass"]
+LSTFORMATS   = ["json", "ndjson"]
+BOOLTRUE     = ["true", "yes", "1"]
+BOOLFALSE    = ["false", "no", "0"]
+JOBNAME      = r'[^\W\d][\w.-]*' # xml tag
+GLOBCHARS    = "*?["
+JOURNALCTL   = "journalctl --no-pager --quiet -o json --output-fields=MESSAGE -u"
+STATSLINE    = r'(?P<job>' + JOBNAME + r')\s*:\s+(?P<text>.*\bsync.*)'
+STATSEVENTS  = [("retry", r'\bretr'), ("failure", r'\bfail|\berror'), ("start", r'\bstart'),
+                ("success", r'\bfinish|\bcomplete|\bsucce|\bdone\b|\bsynced\b')]
+STATSDURATION = r'(\d+(?:\.\d+)?)\s*(ms|s|secs?|seconds?)\b'
+STATSLOGTIME = r'(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d)(?:[,.](\d+))?'
+SERVEMETHODS = ["lst", "add", "del", "shw", "ctl", "batch", "cache", "status", "export", "import", "check", "estimate",
+                "stats", "shares", "settings"]
+NODBCOMMANDS = ["ctl", "stats", "shares"]
+STATUSWORKERS = 16
+CHECKERROR   = "error"
+CHECKWARNING = "warning"
+BLOCKEDOTHER = "Not saved, other jobs in the same call conflict"
+CHECKFIELDS  = ["enabled", "source", "destination", "reversesync", "exclude"]
+WATCHPOLL    = 2
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO  = 0x00000080
+IN_CREATE    = 0x00000100
+IN_DELETE    = 0x00000200
+IN_NONBLOCK  = 0x00000800
+IN_CLOEXEC   = 0x00080000
+INEVENT      = "iIII"
+RPCPARSEERROR    = -32700
+RPCINVALIDREQ    = -32600
+RPCNOMETHOD      = -32601
+RPCCMDERROR      = 1
 ENCODING     = 'utf-8'
+PROFILEENV   = "SYNCWATCH_PROFILE"
+CPROFILEENV  = "SYNCWATCH_CPROFILE"
 #########################################################
 
 ###################### FUNCTIONS ########################
 
+#########################################################
+# Class : timedphase                                    #
+#########################################################
+class timedphase(object):
+    """Times one phase of a command and adds it to its timings.
+    """
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self):
+        if self.timer:
+            self.wall = time.perf_counter()
+            self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *args):
+        if self.timer:
+            self.timer.add(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+        return False
+
+#########################################################
+# Class : timings                                       #
+#########################################################
+class timings(object):
+    """Wall and cpu time per phase of a command, enabled by --timings or
+       SYNCWATCH_PROFILE. Phases with the same name are summed.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.output = ""
+        self.profileFile = ""
+        self.profiler = None
+        self.command = []
+        self.phases = {}
+        self.lock = None
+        self.idle = timedphase(None, "")
+        self.startTime = (0.0, 0.0)
+
+    def phase(self, name):
+        # a context per phase, phases may run in threads
+        if self.enabled:
+            return timedphase(self, name)
+        return self.idle
+
+    def add(self, name, wall, cpu):
+        with self.lock:
+            phase = self.phases.setdefault(name, {"count": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            phase['count'] += 1
+            phase['wall_s'] += wall
+            phase['cpu_s'] += cpu
+
+    def configure(self, argv):
+        # returns argv without timing options
+        args = []
+        env = os.environ.get(PROFILEENV, "")
+        if env:
+            self.enabled = True
+            if env != "1" and env != "stderr":
+                self.output = env
+        self.profileFile = os.environ.get(CPROFILEENV, "")
+        for arg in argv:
+            if arg == "--timings":
+                self.enabled = True
+            elif arg.startswith("--timings="):
+                self.enabled = True
+                self.output = arg.split("=", 1)[1]
+            elif arg.startswith("--profile="):
+                self.profileFile = arg.split("=", 1)[1]
+            else:
+                args.append(arg)
+        if self.enabled:
+            import threading
+            self.lock = threading.Lock()
+        return args
+
+    def start(self, command):
+        self.command = command
+        self.phases = {}
+        self.startTime = (time.perf_counter(), time.process_time())
+        if self.profileFile and not self.profiler:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def report(self):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profileFile)
+            self.profiler = None
+        if not self.enabled:
+            return
+        import json
+        result = {}
+        result['command'] = self.command
+        result['total'] = {}
+        result['total']['wall_s'] = round(time.perf_counter() - self.startTime[0], 6)
+        result['total']['cpu_s'] = round(time.process_time() - self.startTime[1], 6)
+        result['phases'] = {}
+        for name, phase in self.phases.items():
+            result['phases'][name] = {"count": phase['count'], "wall_s": round(phase['wall_s'], 6), "cpu_s": round(phase['cpu_s'], 6)}
+        line = json.dumps(result) + "\n"
+        try:
+            if self.output:
+                with open(self.output, "a") as timings_file:
+                    timings_file.write(line)
+            else:
+                sys.stderr.write(line)
+        except:
+            pass
+
+timer = timings()
+
 #########################################################
 # Class : shell                                         #
 #########################################################
@@ -50,13 +253,15 @@ class shell(object):
         pass
 
     def runCommand(self, cmd, input = None, timeout = None):
+        import subprocess
         CMDNOTEXIST = 127, "", ""
         if input:
             input = input.encode("utf-8")
         try:
             if timeout == 0:
-                timout = None
-            out = subprocess.run(cmd, shell=True, capture_output=True, input = input, timeout = timeout)
+                timeout = None
+            with timer.phase("command: {}".format(cmd)):
+                out = subprocess.run(cmd, shell=True, capture_output=True, input = input, timeout = timeout)
             retval = out.returncode, out.stdout.decode("utf-8"), out.stderr.decode("utf-8")
         except subprocess.TimeoutExpired:
             retval = CMDTIMEOUT, "", ""
@@ -95,7 +300,7 @@ class systemdctl(object):
         except Exception as e:
             print("Error reading systemd information")
             print(e)
-            exit(1)
+            sys.exit(1)
 
     def __del__(self):
         pass
@@ -103,10 +308,22 @@ class systemdctl(object):
     def available(self):
         return self.hasSystemd
 
-    def start(self, service):
+    def start(self, service, timeout = None):
+        return self.submit("start", service, timeout)['result']
+
+    def stop(self, service, timeout = None):
+        return self.submit("stop", service, timeout)['result']
+
+    def reload(self, service, timeout = None):
+        return self.submit("reload", service, timeout)['result']
+
+    def restart(self, service, timeout = None):
+        return self.submit("restart", service, timeout)['result']
+
+    def enable(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLSTART, service)
+            cmd = "{} {}".format(CTLENABLE, service)
             try:
                 shell().command(cmd)
                 retval = True
@@ -114,10 +331,10 @@ class systemdctl(object):
                 pass
         return retval
 
-    def stop(self, service):
+    def disable(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLSTOP, service)
+            cmd = "{} {}".format(CTLDISABLE, service)
             try:
                 shell().command(cmd)
                 retval = True
@@ -125,10 +342,21 @@ class systemdctl(object):
                 pass
         return retval
 
-    def reload(self, service):
+    def status(self, service):
+        retval = []
+        if self.available():
+            cmd = "{} {}".format(CTLSTATUS, service)
+            try:
+                retcode, stdout, stderr = shell().runCommand(cmd)
+                retval = stdout.splitlines()
+            except:
+                pass
+        return retval
+
+    def isActive(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLRELOAD, service)
+            cmd = "{} {}".format(CTLISACTIVE, service)
             try:
                 shell().command(cmd)
                 retval = True
@@ -136,10 +364,10 @@ class systemdctl(object):
                 pass
         return retval
 
-    def restart(self, service):
+    def isEnabled(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLRESTART, service)
+            cmd = "{} {}".format(CTLISENABLED, service)
             try:
                 shell().command(cmd)
                 retval = True
@@ -147,12 +375,139 @@ class systemdctl(object):
                 pass
         return retval
 
+    def canReload(self, service):
+        retval = False
+        if self.available():
+            cmd = "{} {}".format(CTLCANRELOAD, service)
+            try:
+                retval = shell().command(cmd).strip() == "yes"
+            except:
+                pass
+        return retval
+
+    def submit(self, action, service, timeout = None, block = True):
+        """Runs a start, stop, reload or restart job. Without block the job
+           is only queued and its id is returned to wait for it later.
+           A job that times out keeps running in systemd.
+        """
+        result = {}
+        result['result'] = False
+        result['job'] = None
+        result['state'] = "failed"
+        if self.available():
+            cmd = "{} {}{} {}".format(SYSTEMCTL, "" if block else CTLNOBLOCK + " ", action, service)
+            try:
+                returncode, stdout, stderr = shell().runCommand(cmd, timeout = timeout)
+                if returncode == CMDTIMEOUT:
+                    result['job'] = self.getJob(service)
+                    result['state'] = "timeout"
+                elif returncode == 0:
+                    result['result'] = True
+                    if not block:
+                        result['job'] = self.getJob(service)
+                    result['state'] = self.jobState(result['job'])
+            except:
+                pass
+        return result
+
+    def jobState(self, job):
+        # "done" when the job is no longer queued
+        retval = "done"
+        if job != None:
+            for fields in self.listJobs():
+                if fields[0] == str(job):
+                    retval = fields[3]
+        return retval
+
+    def wait(self, job, timeout = None):
+        start = time.monotonic()
+        state = self.jobState(job)
+        while state != "done":
+            if timeout and time.monotonic() - start > timeout:
+                return "timeout"
+            time.sleep(JOBPOLL)
+            state = self.jobState(job)
+        return state
+
+    def subscribe(self, service, callback):
+        # systemctl has no change notifications, poll instead
+        return False
+
+################## INTERNAL FUNCTIONS ###################
+
+    def checkInstalled(self):
+        return shell().commandExists(SYSTEMCTL)
+
+    def unitName(self, service):
+        if not "." in service:
+            service += ".service"
+        return service
+
+    def getJob(self, service):
+        retval = None
+        for fields in self.listJobs():
+            if fields[1] == self.unitName(service):
+                retval = int(fields[0])
+        return retval
+
+    def listJobs(self):
+        # JOB UNIT TYPE STATE
+        jobs = []
+        if self.available():
+            for line in shell().command(CTLLISTJOBS).splitlines():
+                fields = line.split()
+                if len(fields) >= 4 and fields[0].isdigit():
+                    jobs.append(fields)
+        return jobs
+
+#########################################################
+# Class : systemdbus                                    #
+#########################################################
+class systemdbus(object):
+    """Controls systemd units over D-Bus instead of forking systemctl.
+       Requires python3-dbus, the system bus address may be overruled by
+       DBUS_SYSTEM_BUS_ADDRESS, e.g. to test against a stand-in bus.
+    """
+    def __init__(self):
+        self.bus = None
+        self.manager = None
+        try:
+            import dbus
+            self.dbus = dbus
+        except ImportError:
+            self.dbus = None
+        if self.dbus:
+            try:
+                self.bus = dbus.SystemBus()
+                self.manager = dbus.Interface(self.bus.get_object(DBUSSYSTEMD, DBUSSYSTEMDPATH, introspect = False), DBUSMANAGER)
+                self.manager.GetDefaultTarget() # check whether systemd answers
+            except:
+                self.manager = None
+
+    def __del__(self):
+        pass
+
+    def available(self):
+        return self.manager != None
+
+    def start(self, service, timeout = None):
+        return self.submit("start", service, timeout)['result']
+
+    def stop(self, service, timeout = None):
+        return self.submit("stop", service, timeout)['result']
+
+    def reload(self, service, timeout = None):
+        return self.submit("reload", service, timeout)['result']
+
+    def restart(self, service, timeout = None):
+        return self.submit("restart", service, timeout)['result']
+
     def enable(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLENABLE, service)
             try:
-                shell().command(cmd)
+                self.manager.EnableUnitFiles([self.unitName(service)], False, False)
+                self.manager.Reload()
                 retval = True
             except:
                 pass
@@ -161,51 +516,446 @@ class systemdctl(object):
     def disable(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLDISABLE, service)
             try:
-                shell().command(cmd)
+                self.manager.DisableUnitFiles([self.unitName(service)], False)
+                self.manager.Reload()
                 retval = True
             except:
                 pass
         return retval
 
     def status(self, service):
-        retval = []
+        # status shows the journal, which is not available over D-Bus
+        return systemdctl().status(service)
+
+    def isActive(self, service):
+        retval = False
         if self.available():
-            cmd = "{} {}".format(CTLSTATUS, service)
             try:
-                retcode, stdout, stderr = shell().runCommand(cmd)
-                retval = stdout.splitlines()
+                retval = self.getUnitProperty(service, "ActiveState") in DBUSACTIVE
             except:
                 pass
         return retval
 
-    def isActive(self, service):
+    def isEnabled(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLISACTIVE, service)
             try:
-                shell().command(cmd)
-                retval = True
+                retval = self.manager.GetUnitFileState(self.unitName(service)) in DBUSENABLED
             except:
                 pass
         return retval
 
-    def isEnabled(self, service):
+    def canReload(self, service):
         retval = False
         if self.available():
-            cmd = "{} {}".format(CTLISENABLED, service)
             try:
-                shell().command(cmd)
-                retval = True
+                retval = bool(self.getUnitProperty(service, "CanReload"))
             except:
                 pass
         return retval
 
+    def submit(self, action, service, timeout = None, block = True):
+        """Queues a start, stop, reload or restart job. With block, wait
+           like systemctl until the job is finished or timeout expires.
+           A job that times out keeps running in systemd.
+        """
+        result = {}
+        result['result'] = False
+        result['job'] = None
+        result['state'] = "failed"
+        if self.available():
+            if block and not self.hasMainLoop():
+                # the job result only comes as a signal
+                return systemdctl().submit(action, service, timeout, block)
+            method = DBUSJOBMETHODS[action]
+            try:
+                with timer.phase("dbus: {}".format(method)):
+                    if block:
+                        result.update(self.runJob(method, service, timeout))
+                    else:
+                        job = getattr(self.manager, method)(self.unitName(service), "replace")
+                        result['job'] = self.jobId(job)
+                        result['state'] = self.jobState(result['job'])
+                        result['result'] = True
+                if result['state'] == "done":
+                    result['job'] = None
+            except:
+                pass
+        return result
+
+    def runJob(self, method, service, timeout = None):
+        """Runs a job and waits for its JobRemoved signal, which tells
+           whether the job succeeded, like systemctl does. The unit state
+           does not, a failed reload leaves the unit active.
+        """
+        from gi.repository import GLib
+        from dbus.mainloop.glib import DBusGMainLoop
+        result = {}
+        removed = {}
+        bus = self.dbus.SystemBus(private = True, mainloop = DBusGMainLoop())
+        try:
+            manager = self.dbus.Interface(bus.get_object(DBUSSYSTEMD, DBUSSYSTEMDPATH, introspect = False), DBUSMANAGER)
+            manager.Subscribe() # systemd only sends job signals to subscribers
+            bus.add_signal_receiver(lambda id, job, unit, jobResult: removed.update({int(id): str(jobResult)}),
+                                    signal_name = "JobRemoved", dbus_interface = DBUSMANAGER, path = DBUSSYSTEMDPATH)
+            result['job'] = self.jobId(getattr(manager, method)(self.unitName(service), "replace"))
+            context = GLib.MainContext.default()
+            start = time.monotonic()
+            while not result['job'] in removed:
+                if timeout and time.monotonic() - start > timeout:
+                    break
+                if not context.iteration(False):
+                    time.sleep(DBUSJOBPOLL)
+        finally:
+            bus.close()
+        if result['job'] in removed:
+            result['result'] = removed[result['job']] in DBUSJOBDONE
+            result['state'] = "done" if result['result'] else "failed"
+            result['job'] = None
+        else:
+            result['result'] = False
+            result['state'] = "timeout"
+        return result
+
+    def jobState(self, job):
+        # "done" when the job is no longer queued
+        retval = "done"
+        if job != None:
+            try:
+                path = self.manager.GetJob(self.dbus.UInt32(job))
+                props = self.dbus.Interface(self.bus.get_object(DBUSSYSTEMD, path, introspect = False), DBUSPROPERTIES)
+                retval = str(props.Get(DBUSJOB, "State"))
+            except self.dbus.exceptions.DBusException:
+                pass # job finished and removed
+        return retval
+
+    def wait(self, job, timeout = None):
+        start = time.monotonic()
+        state = self.jobState(job)
+        while state != "done":
+            if timeout and time.monotonic() - start > timeout:
+                return "timeout"
+            time.sleep(DBUSJOBPOLL)
+            state = self.jobState(job)
+        return state
+
+    def subscribe(self, service, callback):
+        """Calls callback when the unit or the unit files change. Signals
+           are dispatched by a GLib main loop on a private connection,
+           returns False if this is not possible.
+        """
+        if not self.available():
+            return False
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop
+            bus = self.dbus.SystemBus(private = True, mainloop = DBusGMainLoop())
+            manager = self.dbus.Interface(bus.get_object(DBUSSYSTEMD, DBUSSYSTEMDPATH, introspect = False), DBUSMANAGER)
+            manager.Subscribe() # systemd only sends unit signals to subscribers
+            path = manager.LoadUnit(self.unitName(service))
+            bus.add_signal_receiver(lambda *args: callback(), signal_name = "PropertiesChanged",
+                                    dbus_interface = DBUSPROPERTIES, path = path)
+            bus.add_signal_receiver(lambda *args: callback(), signal_name = "UnitFilesChanged",
+                                    dbus_interface = DBUSMANAGER, path = DBUSSYSTEMDPATH)
+            self.signalBus = bus
+        except:
+            return False
+        return True
+
 ################## INTERNAL FUNCTIONS ###################
 
-    def checkInstalled(self):
-        return shell().commandExists(SYSTEMCTL)
+    def unitName(self, service):
+        if not "." in service:
+            service += ".service"
+        return service
+
+    def jobId(self, job):
+        return int(str(job).rsplit("/", 1)[1])
+
+    def hasMainLoop(self):
+        try:
+            from gi.repository import GLib
+            from dbus.mainloop.glib import DBusGMainLoop
+        except ImportError:
+            return False
+        return True
+
+    def getUnitProperty(self, service, name):
+        with timer.phase("dbus: {}".format(name)):
+            path = self.manager.LoadUnit(self.unitName(service))
+            props = self.dbus.Interface(self.bus.get_object(DBUSSYSTEMD, path, introspect = False), DBUSPROPERTIES)
+            return props.Get(DBUSUNIT, name)
+
+#########################################################
+# Class : inotify                                       #
+#########################################################
+class inotify(object):
+    """Minimal inotify binding on libc, returns names of changed files
+       in a watched folder.
+    """
+    def __init__(self):
+        self.fd = -1
+        try:
+            import ctypes
+            import ctypes.util
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+            self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except:
+            self.fd = -1
+
+    def __del__(self):
+        self.close()
+
+    def available(self):
+        return self.fd >= 0
+
+    def fileno(self):
+        return self.fd
+
+    def addWatch(self, path, mask):
+        wd = -1
+        if self.available():
+            wd = self.libc.inotify_add_watch(self.fd, path.encode(ENCODING), mask)
+        return wd >= 0
+
+    def read(self):
+        import struct
+        names = []
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            data = b""
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = struct.unpack_from(INEVENT, data, offset)
+            offset += struct.calcsize(INEVENT)
+            names.append(data[offset:offset + length].rstrip(b"\0").decode(ENCODING))
+            offset += length
+        return names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+#########################################################
+# Class : pathindex                                     #
+#########################################################
+class pathindex(object):
+    """Prefix tree on path components, finds the paths equal to, inside or
+       containing a path without comparing all pairs of paths.
+    """
+    def __init__(self):
+        self.root = [[], {}] # values, children
+
+    def __del__(self):
+        pass
+
+    def add(self, path, value):
+        node = self.root
+        for part in self.parts(path):
+            node = node[1].setdefault(part, [[], {}])
+        node[0].append(value)
+
+    def overlaps(self, path):
+        # values of the paths containing, equal to or inside path
+        found = []
+        node = self.root
+        for part in self.parts(path):
+            found.extend(node[0])
+            node = node[1].get(part)
+            if node == None:
+                return found
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            found.extend(node[0])
+            nodes.extend(node[1].values())
+        return found
+
+################## INTERNAL FUNCTIONS ###################
+
+    def parts(self, path):
+        return [part for part in path.split("/") if part]
+
+#########################################################
+# Class : syncstats                                     #
+#########################################################
+class syncstats(object):
+    """Per job sync statistics from the daemon journal or a log file. Only
+       entries after the saved cursor are read, the aggregates are kept in
+       a store in the cache folder, so a query doesn't read the log again.
+    """
+    def __init__(self, log = ""):
+        import re
+        self.source = "file:" + os.path.realpath(log) if log else "journal"
+        self.log = log
+        self.line = re.compile(STATSLINE, re.I)
+        self.events = [(event, re.compile(pattern, re.I)) for event, pattern in STATSEVENTS]
+        self.duration = re.compile(STATSDURATION, re.I)
+        self.logTime = re.compile(STATSLOGTIME)
+        self.times = {}
+        self.sources = {}
+        self.cursor = None
+        self.jobs = {}
+        self.touched = set()
+        self.read = 0
+        self.load()
+
+    def __del__(self):
+        pass
+
+    def update(self):
+        # reads the new entries and saves when there were any
+        if self.log:
+            self.readLog()
+        else:
+            self.readJournal()
+        for name in self.touched:
+            self.jobs[name]['percentiles'] = self.percentiles(self.jobs[name]['durations'])
+        if self.read:
+            self.save()
+        return self.read
+
+    def query(self, name):
+        job = self.jobs[name]
+        stats = {}
+        stats['syncs'] = job['successes'] + job['failures']
+        stats['successes'] = job['successes']
+        stats['failures'] = job['failures']
+        stats['retries'] = job['retries']
+        stats['lastSuccess'] = job['lastSuccess']
+        stats['lastFailure'] = job['lastFailure']
+        stats['running'] = job['started'] != None
+        stats['duration'] = dict(job['percentiles'])
+        stats['duration']['samples'] = len(job['durations'])
+        return stats
+
+    def names(self):
+        return list(self.jobs)
+
+################## INTERNAL FUNCTIONS ###################
+
+    def readJournal(self):
+        import json
+        import shlex
+        cmd = "{} {}".format(JOURNALCTL, DAEMONSYNCWATCH)
+        if self.cursor:
+            cmd += " --after-cursor={}".format(shlex.quote(self.cursor))
+        retcode, stdout, stderr = shell().runCommand(cmd)
+        if retcode:
+            raise Exception("Reading the journal failed: {}".format(stderr.strip() or retcode))
+        for line in stdout.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            message = entry.get('MESSAGE', "")
+            if isinstance(message, list): # not valid utf-8
+                message = bytes(message).decode(ENCODING, "replace")
+            self.parse(message, int(entry.get('__REALTIME_TIMESTAMP', 0)) / 1e6 or None)
+            self.cursor = entry.get('__CURSOR', self.cursor)
+            self.read += 1
+
+    def readLog(self):
+        # cursor is (inode, offset), starts over when the log is rotated or truncated
+        with open(self.log, "rb") as log_file:
+            stat = os.fstat(log_file.fileno())
+            inode, offset = self.cursor if self.cursor else (stat.st_ino, 0)
+            if inode != stat.st_ino or offset > stat.st_size:
+                inode, offset = stat.st_ino, 0
+            log_file.seek(offset)
+            data = log_file.read()
+        end = data.rfind(b"\n") + 1 # a line being written is read next time
+        for line in data[:end].decode(ENCODING, "replace").splitlines():
+            self.parse(line, self.parseTime(line))
+            self.read += 1
+        self.cursor = (inode, offset + end)
+
+    def parseTime(self, line):
+        match = self.logTime.match(line)
+        if not match:
+            return None
+        seconds = self.times.get(match.group(1))
+        if seconds == None:
+            seconds = time.mktime(time.strptime(match.group(1).replace("T", " "), "%Y-%m-%d %H:%M:%S"))
+            self.times[match.group(1)] = seconds
+        if match.group(2):
+            seconds += float("0." + match.group(2))
+        return seconds
+
+    def parse(self, message, stamp):
+        match = self.line.search(message)
+        if not match:
+            return
+        # a retry may be announced with the failure
+        for event, pattern in self.events:
+            if pattern.search(match.group('text')):
+                self.add(match.group('job'), event, stamp, match.group('text'))
+                if event != "retry":
+                    return
+
+    def add(self, name, event, stamp, text):
+        if not name in self.jobs:
+            self.jobs[name] = {"successes": 0, "failures": 0, "retries": 0, "lastSuccess": None,
+                               "lastFailure": None, "started": None, "durations": [], "percentiles": self.percentiles([])}
+        job = self.jobs[name]
+        if event == "start":
+            job['started'] = stamp
+            return
+        if event == "retry":
+            job['retries'] += 1
+            return
+        if event == "success":
+            job['successes'] += 1
+            job['lastSuccess'] = stamp
+        else:
+            job['failures'] += 1
+            job['lastFailure'] = stamp
+        match = self.duration.search(text)
+        if match:
+            duration = float(match.group(1)) / (1000 if match.group(2).lower() == "ms" else 1)
+        elif job['started'] != None and stamp != None:
+            duration = max(stamp - job['started'], 0)
+        else:
+            duration = None
+        if duration != None:
+            job['durations'] = (job['durations'] + [round(duration, 3)])[-STATSSAMPLES:]
+            self.touched.add(name)
+        job['started'] = None
+
+    def percentiles(self, durations):
+        # nearest rank over the last samples
+        result = {}
+        ordered = sorted(durations)
+        for percentile in STATSPERCENTILES:
+            key = "p{}".format(percentile)
+            result[key] = ordered[max(-(-percentile * len(ordered) // 100) - 1, 0)] if ordered else None
+        return result
+
+    def load(self):
+        # marshal.load reads a file in small pieces, loads of the whole file is faster
+        try:
+            with open(os.path.join(CACHEPATH, STATS_FILENAME), "rb") as stats_file:
+                version, sources = marshal.loads(stats_file.read())
+            if version == STATSVERSION:
+                self.sources = sources
+        except:
+            pass
+        if self.source in self.sources:
+            self.cursor, self.jobs = self.sources[self.source]
+
+    def save(self):
+        statspath = os.path.join(CACHEPATH, STATS_FILENAME)
+        self.sources[self.source] = (self.cursor, self.jobs)
+        try:
+            if not os.path.isdir(CACHEPATH):
+                os.makedirs(CACHEPATH)
+            with open(statspath + ".{}.tmp".format(os.getpid()), "wb") as stats_file:
+                marshal.dump((STATSVERSION, self.sources), stats_file)
+            os.replace(statspath + ".{}.tmp".format(os.getpid()), statspath)
+        except:
+            pass # no write access, read from the start next time
 
 #########################################################
 # Class : database                                      #
@@ -213,6 +963,18 @@ class systemdctl(object):
 class database(object):
     def __init__(self):
         self.db = {}
+        self.settings = {}
+        self.comments = {}
+        self.duplicates = []
+        self.typeErrors = []
+        self.index = {}
+        self.spans = None
+        self.spanClose = 0
+        self.dirty = {}
+        self.settingsDirty = False
+        self.stamp = None
+        self.lockFile = None
+        self.lockWait = 0.0
         if not self.getXMLpath(False):
             # only create xml if super user, otherwise keep empty
             self.createXML()
@@ -227,14 +989,122 @@ class database(object):
     def __call__(self):
         return self.db
 
+    def getItem(self, name):
+        with timer.phase("lookup"):
+            key = self.index.get(name.strip())
+            return self.db[key] if key != None else {}
+
+    def getName(self, name):
+        return self.index.get(name.strip(), "")
+
+    def getSetting(self, name):
+        return self.settings.get(name, SETTINGDEFAULTS[name])
+
+    def setSetting(self, name, value):
+        # settings are attributes of the root, job parsers ignore them
+        self.settings[name] = value
+        self.settingsDirty = True
+
+    def setItem(self, name, item):
+        # also call after editing an item in place, so it is written
+        key = self.index.get(name.strip())
+        if key == None:
+            key = name.strip()
+            self.dirty.pop(key, None)
+            self.dirty[key] = "added"
+        elif not key in self.dirty:
+            self.dirty[key] = "modified"
+        self.db[key] = item
+        self.index[key.strip()] = key
+
+    def delItem(self, name):
+        key = self.index.pop(name.strip(), None)
+        if key != None:
+            del self.db[key]
+            self.comments.pop(key, None)
+            self.comments.pop(key + "/", None)
+            self.dirty.pop(key, None)
+            self.dirty[key] = "removed"
+
     def update(self):
+        self.write()
+        self.unlock()
+
+    def write(self):
+        # keeps the lock, e.g. to write the reload delta before unlocking
         self.updateXML()
+        self.stamp = self.getStamp()
+
+    def lock(self):
+        """Serialize read-modify-write cycles between cli instances.
+           Waits at most LOCKTIMEOUT seconds and reloads when another
+           instance changed the xml meanwhile.
+        """
+        if self.lockFile:
+            return
+        with timer.phase("lock"):
+            self.getLock()
+
+    def getLock(self):
+        import fcntl
+        lockpath = LOCKPATH if os.path.isdir(LOCKPATH) else ETCPATH
+        start = time.monotonic()
+        try:
+            self.lockFile = open(os.path.join(lockpath, LOCK_FILENAME), "a")
+            while True:
+                try:
+                    fcntl.flock(self.lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() - start > LOCKTIMEOUT:
+                        raise TimeoutError("Timeout after {} seconds".format(LOCKTIMEOUT))
+                    time.sleep(LOCKRETRY)
+        except Exception as e:
+            self.unlock()
+            print("Error locking xml file")
+            print(e)
+            sys.exit(1)
+        self.lockWait = time.monotonic() - start
+        if self.changed():
+            self.reload()
+        if self.duplicates:
+            self.unlock()
+            print("Duplicate job names in xml file: {}".format(", ".join(self.duplicates)))
+            print("Only the last job with the same name is loaded, fix the XML file before editing")
+            sys.exit(1)
+
+    def unlock(self):
+        if self.lockFile:
+            self.lockFile.close() # releases flock
+            self.lockFile = None
 
     def reload(self):
         del self.db
         self.db = {}
         self.getXML()
 
+    def changed(self):
+        return self.getStamp() != self.stamp
+
+    def getStamp(self):
+        try:
+            stat = os.stat(os.path.join(ETCPATH, XML_FILENAME))
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except:
+            stamp = None
+        return stamp
+
+    def cacheStats(self):
+        stats = {}
+        try:
+            with open(os.path.join(CACHEPATH, CACHESTATS_FILENAME), "rb") as stats_file:
+                counts = self.cacheCounts(stats_file.read())
+        except OSError:
+            counts = self.cacheCounts(b"")
+        stats.update(zip(CACHECOUNTERS, counts))
+        stats['valid'] = self.loadCache() != None
+        return stats
+
     def bl(self, val):
         retval = False
         try:
@@ -248,26 +1118,32 @@ class database(object):
 
 ################## INTERNAL FUNCTIONS ###################
 
-    def gettype(self, text, txtype = True):
-        try:
-            retval = int(text)
-        except:
-            try:
-                retval = float(text)
-            except:
-                if text:
-                    if text.lower() == "false":
-                        retval = False
-                    elif text.lower() == "true":
-                        retval = True
-                    elif txtype:
-                        retval = text
-                    else:
-                        retval = ""
-                else:
-                    retval = ""
-
-        return retval
+    def decode(self, field, text, job = ""):
+        """Decodes a leaf to the type declared for field in JOBFIELDS, or
+           in SETTINGFIELDS for an attribute of the root, unknown fields stay
+           strings. On a type error the text is kept and the error is added
+           to typeErrors.
+        """
+        kind = JOBFIELDS.get(field, str) if job else SETTINGFIELDS.get(field, str)
+        if not text:
+            text = ""
+        if kind is str:
+            return text
+        value = text.strip().lower()
+        if kind is bool:
+            if value in BOOLTRUE:
+                return True
+            if value in BOOLFALSE:
+                return False
+        elif (value[1:] if value[:1] in "+-" else value).isdecimal():
+            return int(value)
+        error = {}
+        error['job'] = job
+        error['field'] = field
+        error['value'] = text
+        error['expected'] = kind.__name__
+        self.typeErrors.append(error)
+        return text
 
     def settype(self, element):
         retval = ""
@@ -284,95 +1160,450 @@ class database(object):
     def getXML(self):
         XMLpath = self.getXMLpath()
         try:
-            tree = ET.parse(XMLpath)
-            root = tree.getroot()
-            self.db = self.parseKids(root, True)
+            self.stamp = self.getStamp()
+            self.dirty = {}
+            self.settingsDirty = False
+            with timer.phase("cacheload"):
+                cache = self.loadCache()
+            if cache != None:
+                self.db, self.settings, self.comments, self.duplicates, self.typeErrors, self.spans, self.spanClose = cache
+                self.countCache('hits')
+            else:
+                with timer.phase("parse"):
+                    import xml.etree.ElementTree as ET
+                    with open(XMLpath, "rb") as xml_file:
+                        data = xml_file.read()
+                    parser = ET.XMLParser(target = ET.TreeBuilder(insert_comments = True))
+                    parser.feed(data)
+                    root = parser.close()
+                with timer.phase("typeconversion"):
+                    self.typeErrors = []
+                    self.db = self.parseKids(root)
+                    self.settings = self.parseSettings(root)
+                    self.comments = self.parseComments(root)
+                    self.duplicates = self.parseDuplicates(root)
+                with timer.phase("spans"):
+                    self.spans, self.spanClose = self.parseSpans(data, root)
+                with timer.phase("cachesave"):
+                    self.saveCache()
+                    self.countCache('misses')
+            with timer.phase("index"):
+                self.buildIndex()
         except Exception as e:
             print("Error parsing xml file")
             print("Check XML file syntax for errors")
             print(e)
-            exit(1)
+            sys.exit(1)
 
-    def parseKids(self, item, isRoot = False):
+    def parseKids(self, item, job = ""):
         db = {}
-        if self.hasKids(item):
-            for kid in item:
-                if self.hasKids(kid):
-                    db[kid.tag] = self.parseKids(kid)
-                else:
-                    db.update(self.parseKids(kid))
-        elif not isRoot:
-            db[item.tag] = self.gettype(item.text)
+        for kid in item:
+            if not isinstance(kid.tag, str): # comment
+                continue
+            if self.hasKids(kid):
+                db[kid.tag] = self.parseKids(kid, kid.tag)
+            elif job:
+                db[kid.tag] = self.decode(kid.tag, kid.text, job)
+            else:
+                db[kid.tag] = {} # a job without fields
         return db
 
+    def parseSettings(self, root):
+        return {name: self.decode(name, value) for name, value in root.attrib.items()}
+
     def hasKids(self, item):
         retval = False
         for kid in item:
-            retval = True
-            break
+            if isinstance(kid.tag, str): # not a comment
+                retval = True
+                break
         return retval
 
-    def updateXML(self):
-        db = ET.Element('syncs')
-        pcomment = self.getXMLcomment("")
-        if pcomment:
-            comment = ET.Comment(pcomment)
-            db.append(comment)
-        self.buildXML(db, self.db)
+    def parseDuplicates(self, root):
+        duplicates = []
+        names = set()
+        for kid in root:
+            if isinstance(kid.tag, str): # not a comment
+                if kid.tag in names and not kid.tag in duplicates:
+                    duplicates.append(kid.tag)
+                names.add(kid.tag)
+        return duplicates
+
+    def buildIndex(self):
+        self.index = {}
+        for key in self.db:
+            self.index.setdefault(key.strip(), key)
+
+    def parseComments(self, root):
+        """Collect comments by position, as ET.parse would drop them:
+           ""     : header comments before the first job
+           job    : comments in front of job
+           job/   : comments inside job
+           /      : trailing comments after the last job
+        """
+        import xml.etree.ElementTree as ET
+        comments = {}
+        pending = []
+        header = True
+        for kid in root:
+            if kid.tag is ET.Comment:
+                if header:
+                    comments.setdefault("", []).append(kid.text)
+                else:
+                    pending.append(kid.text)
+            else:
+                header = False
+                if pending:
+                    comments[kid.tag] = pending
+                    pending = []
+                inner = [comment.text for comment in kid.iter(ET.Comment)]
+                if inner:
+                    comments[kid.tag + "/"] = inner
+        if pending:
+            comments["/"] = pending
+        return comments
+
+    def parseSpans(self, data, root):
+        """Byte offsets of the jobs in the xml file, to patch a single job:
+           job : [start of comments in front, start, end], start and end
+                 include the indent and the trailing newline
+           Returns (None, 0) if the file cannot be patched.
+        """
+        import re
+        tokens = re.compile(SPANTOKENS, re.S)
+        jobs = re.compile(SPANJOB, re.S) # a job with only fields and comments in one match
+        spans = {}
+        names = []
+        close = None
+        inRoot = False
+        region = None
+        pos = 0
+        while close == None:
+            token = tokens.search(data, pos)
+            if not token:
+                break
+            pos = token.end()
+            closing, tag, empty = token.groups()
+            if tag == None: # comment, cdata, declaration
+                continue
+            if not inRoot:
+                if closing or empty:
+                    break
+                inRoot = True
+            elif closing:
+                close = self.lineStart(data, token.start())
+            else:
+                names.append(tag.decode(ENCODING))
+                start = self.lineStart(data, token.start())
+                if not empty:
+                    job = jobs.match(data, token.start())
+                    pos = job.end() if job else self.skipElement(tokens, data, pos)
+                    if pos == None:
+                        break
+                spans[names[-1]] = [start if region == None else region, start, self.lineEnd(data, pos)]
+                region = spans[names[-1]][2]
+        kids = [kid.tag for kid in root if isinstance(kid.tag, str)]
+        if close == None or names != kids or len(spans) != len(names):
+            return None, 0
+        return spans, close
+
+    def skipElement(self, tokens, data, pos):
+        # end of the element started before pos
+        depth = 1
+        token = tokens.search(data, pos)
+        while token:
+            closing, tag, empty = token.groups()
+            if closing:
+                depth -= 1
+                if depth == 0:
+                    return token.end()
+            elif tag != None and not empty:
+                depth += 1
+            token = tokens.search(data, token.end())
+        return None
+
+    def lineStart(self, data, pos):
+        start = pos
+        while start > 0 and data[start - 1] in b" \t":
+            start -= 1
+        return start if start == 0 or data[start - 1] == 10 else pos # 10 is newline
+
+    def lineEnd(self, data, pos):
+        end = pos
+        while end < len(data) and data[end] in b" \t\r":
+            end += 1
+        return end + 1 if end < len(data) and data[end] == 10 else pos
+
+    def patchXML(self, XMLpath):
+        """Replaces only the changed jobs in the xml file as loaded, so
+           other jobs keep their formatting and comments. New jobs are
+           appended after the last job. Returns None if not possible.
+        """
+        import io
+        import bisect
+        import xml.etree.ElementTree as ET
+        if self.spans == None or self.duplicates:
+            return None
+        with open(XMLpath, "rb") as xml_file:
+            data = xml_file.read()
+        if not self.stamp or len(data) != self.stamp[1]:
+            return None
+        try:
+            insert = max([span[2] for span in self.spans.values()], default = self.spanClose)
+            edits = []
+            if self.settingsDirty:
+                edits.append(self.patchRoot(data))
+            modified = {}
+            appended = []
+            for name, kind in self.dirty.items():
+                span = self.spans.pop(name, None)
+                self.typeErrors = [error for error in self.typeErrors if error['job'] != name]
+                if span and kind != "modified":
+                    edits.append((span[0], span[2], b""))
+                if kind == "removed":
+                    continue
+                content = io.StringIO()
+                self.writeKid(content, name, self.db[name], "\t", self.comments.get(name + "/"))
+                job = content.getvalue().encode(ENCODING)
+                if span and kind == "modified":
+                    edits.append((span[1], span[2], job))
+                    modified[name] = span[:2] + [span[1] + len(job)]
+                else:
+                    appended.append(job)
+                    modified[name] = None
+                # decode the written job as a reload would
+                self.db[name] = self.parseKids(ET.fromstring(job), name)
+            edits.sort()
+            ends = [edit[1] for edit in edits]
+            shifts = [0]
+            for start, end, replacement in edits:
+                shifts.append(shifts[-1] + len(replacement) - (end - start))
+            moved = lambda offset: offset + shifts[bisect.bisect_right(ends, offset)]
+            if appended:
+                edits.append((insert, insert, b"".join(appended)))
+                edits.sort()
+            pieces = []
+            pos = 0
+            for start, end, replacement in edits:
+                pieces.append(data[pos:start])
+                pieces.append(replacement)
+                pos = end
+            pieces.append(data[pos:])
+            for name, span in self.spans.items():
+                span[:] = [moved(offset) for offset in span]
+            at = moved(insert)
+            for name, span in modified.items():
+                if span:
+                    length = span[2] - span[1]
+                    span = [moved(span[0]), moved(span[1])]
+                    span.append(span[1] + length)
+                else:
+                    length = len(appended.pop(0))
+                    span = [at, at, at + length]
+                    at += length
+                self.spans[name] = span
+            self.spanClose = moved(self.spanClose) + (at - moved(insert))
+            self.moveComments()
+        except:
+            self.spans = None
+            return None
+        return b"".join(pieces)
+
+    def patchRoot(self, data):
+        # the root start tag with the settings, decoded as a reload would
+        import re
+        import xml.etree.ElementTree as ET
+        tokens = re.compile(SPANTOKENS, re.S)
+        token = tokens.search(data)
+        while token.group(2) == None: # comment, cdata, declaration
+            token = tokens.search(data, token.end())
+        tag = self.rootTag(self.settings).encode(ENCODING)
+        self.settings = self.parseSettings(ET.fromstring(tag + b"</syncs>"))
+        return (token.start(), token.end(), tag)
+
+    def moveComments(self):
+        # comments in front of the first job, or after the last job if
+        # there are no jobs left, are header comments when parsed
+        if not self.spans:
+            if "/" in self.comments:
+                self.comments.setdefault("", []).extend(self.comments.pop("/"))
+            return
+        name = min(self.spans, key = lambda name: self.spans[name][1])
+        span = self.spans[name]
+        if span[0] != span[1]:
+            span[0] = span[1]
+            if name in self.comments:
+                self.comments.setdefault("", []).extend(self.comments.pop(name))
 
+    def updateXML(self):
         XMLpath = self.getXMLpath(dowrite = True)
+        XMLdir = os.path.dirname(XMLpath)
+        import tempfile
 
-        with open(XMLpath, "w") as xml_file:
-            xml_file.write(self.prettify(db))
-
-    def buildXML(self, xmltree, item):
-        if isinstance(item, dict):
-            for key, value in item.items():
-                kid = ET.SubElement(xmltree, key)
-                self.buildXML(kid, value)
+        # write to a temporary file and rename, so the xml is never left truncated
+        stat = os.stat(XMLpath)
+        try:
+            fd, tmppath = tempfile.mkstemp(prefix = "." + XML_FILENAME + ".", dir = XMLdir)
+        except Exception as e:
+            print("XML file cannot be written")
+            print(e)
+            sys.exit(1)
+        try:
+            with timer.phase("serialize"):
+                data = self.patchXML(XMLpath)
+                if data == None:
+                    import io
+                    content = io.StringIO()
+                    self.writeXML(content, self.db, self.comments, self.settings)
+                    data = content.getvalue().encode(ENCODING)
+                    self.spans = None
+            with timer.phase("write"):
+                with os.fdopen(fd, "wb") as xml_file:
+                    xml_file.write(data)
+                    xml_file.flush()
+                    os.fsync(xml_file.fileno())
+                os.chmod(tmppath, stat.st_mode & 0o7777)
+                os.chown(tmppath, stat.st_uid, stat.st_gid)
+                os.replace(tmppath, XMLpath)
+                dirfd = os.open(XMLdir, os.O_RDONLY)
+                try:
+                    os.fsync(dirfd)
+                finally:
+                    os.close(dirfd)
+        except:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        self.dirty = {}
+        self.settingsDirty = False
+        self.stamp = self.getStamp()
+        if self.spans != None:
+            # patched jobs are decoded as written
+            self.saveCache()
         else:
-            xmltree.text = self.settype(item)
+            # written types may parse differently, so rebuild cache on next load
+            self.removeCache()
 
     def createXML(self):
         print("Creating new XML file")
-        db = ET.Element('syncs')
-        comment = ET.Comment("This XML file describes the synchronizations to be done.\n"
+        comment = ("This XML file describes the synchronizations to be done.\n"
         "            Add a sync to syncs to add a synchronization.")
-        db.append(comment)
 
         XMLpath = self.getNewXMLpath()
 
         with open(XMLpath, "w") as xml_file:
-            xml_file.write(self.prettify(db))
+            self.writeXML(xml_file, {}, {"": [comment]})
 
-    def getXMLcomment(self, tag):
-        comment = ""
-        XMLpath = self.getXMLpath()
-        with open(XMLpath, 'r') as xml_file:
-            content = xml_file.read()
-            if tag:
-                xmltag = "<{}>".format(tag)
-                xmlend = "</{}>".format(tag)
-                begin = content.find(xmltag)
-                end = content.find(xmlend)
-                content = content[begin:end]
-            cmttag = "<!--"
-            cmtend = "-->"
-            begin = content.find(cmttag)
-            end = content.find(cmtend)
-            if (begin > -1) and (end > -1):
-                comment = content[begin+len(cmttag):end]
-        return comment
-
-    def prettify(self, elem):
-        """Return a pretty-printed XML string for the Element.
+    def writeXML(self, xml_file, db, comments = {}, settings = {}):
+        """Write db as pretty-printed XML in a single pass.
+           Output is formatted like minidom's toprettyxml with tab indent.
+        """
+        xml_file.write('<?xml version="1.0" encoding="{}"?>\n'.format(ENCODING))
+        if not db and not comments:
+            xml_file.write(self.rootTag(settings, True) + "\n")
+            return
+        xml_file.write(self.rootTag(settings) + "\n")
+        self.writeComments(xml_file, comments.get(""), "\t")
+        for key, value in db.items():
+            self.writeComments(xml_file, comments.get(key), "\t")
+            self.writeKid(xml_file, key, value, "\t", comments.get(key + "/"))
+        self.writeComments(xml_file, comments.get("/"), "\t")
+        xml_file.write("</syncs>\n")
+
+    def rootTag(self, settings, empty = False):
+        attributes = "".join(' {}="{}"'.format(key, self.escape(self.settype(value))) for key, value in settings.items())
+        return "<syncs{}{}>".format(attributes, "/" if empty else "")
+
+    def writeComments(self, xml_file, comments, indent):
+        if comments:
+            for comment in comments:
+                xml_file.write("{}<!--{}-->\n".format(indent, comment))
+
+    def writeKids(self, xml_file, item, indent):
+        for key, value in item.items():
+            self.writeKid(xml_file, key, value, indent)
+
+    def writeKid(self, xml_file, key, value, indent, comments = None):
+        if isinstance(value, dict):
+            if value or comments:
+                xml_file.write("{}<{}>\n".format(indent, key))
+                self.writeComments(xml_file, comments, indent + "\t")
+                self.writeKids(xml_file, value, indent + "\t")
+                xml_file.write("{}</{}>\n".format(indent, key))
+            else:
+                xml_file.write("{}<{}/>\n".format(indent, key))
+        else:
+            text = self.settype(value)
+            if text:
+                xml_file.write("{0}<{1}>{2}</{1}>\n".format(indent, key, self.escape(text)))
+            else:
+                xml_file.write("{}<{}/>\n".format(indent, key))
+
+    def escape(self, text):
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+    def loadCache(self):
+        cache = None
+        try:
+            with open(os.path.join(CACHEPATH, CACHE_FILENAME), "rb") as cache_file:
+                version, stamp, cachedb, settings, comments, duplicates, typeErrors, spans, spanClose = marshal.loads(cache_file.read())
+            if version == CACHEVERSION and stamp and tuple(stamp) == self.getStamp():
+                cache = cachedb, settings, comments, duplicates, typeErrors, spans, spanClose
+        except:
+            pass
+        return cache
+
+    def saveCache(self):
+        cachepath = os.path.join(CACHEPATH, CACHE_FILENAME)
+        try:
+            if not os.path.isdir(CACHEPATH):
+                os.makedirs(CACHEPATH)
+            # readers save unlocked, so every process has its own temporary file
+            tmppath = cachepath + ".{}.tmp".format(os.getpid())
+            with open(tmppath, "wb") as cache_file:
+                marshal.dump((CACHEVERSION, self.stamp, self.db, self.settings, self.comments, self.duplicates, self.typeErrors,
+                              self.spans, self.spanClose), cache_file)
+            os.replace(tmppath, cachepath)
+        except:
+            pass # no write access, only parse
+
+    def removeCache(self):
+        try:
+            os.remove(os.path.join(CACHEPATH, CACHE_FILENAME))
+        except:
+            pass
+
+    def countCache(self, counter):
+        """Hits and misses are counters of a fixed size in the stats file,
+           incremented in place under a lock, so the file never grows.
         """
-        rough_string = ET.tostring(elem, ENCODING)
-        reparsed = parseString(rough_string)
-        return reparsed.toprettyxml(indent="\t").replace('<?xml version="1.0" ?>','<?xml version="1.0" encoding="%s"?>' % ENCODING)
+        import fcntl
+        try:
+            fd = os.open(os.path.join(CACHEPATH, CACHESTATS_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return # no write access
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            size = CACHECOUNTERSIZE * len(CACHECOUNTERS)
+            data = os.pread(fd, size + 1, 0)
+            counts = self.cacheCounts(data)
+            counts[CACHECOUNTERS.index(counter)] += 1
+            os.pwrite(fd, b"".join(count.to_bytes(CACHECOUNTERSIZE, "little") for count in counts), 0)
+            if len(data) > size:
+                os.ftruncate(fd, size)
+        except OSError:
+            pass
+        finally:
+            os.close(fd) # releases flock
+
+    def cacheCounts(self, data):
+        # an empty or unknown stats file starts at zero
+        if len(data) != CACHECOUNTERSIZE * len(CACHECOUNTERS):
+            return [0] * len(CACHECOUNTERS)
+        return [int.from_bytes(data[pos:pos + CACHECOUNTERSIZE], "little") for pos in range(0, len(data), CACHECOUNTERSIZE)]
 
     def getXMLpath(self, doexit = True, dowrite = False):
-        etcpath = "/etc/"
+        etcpath = ETCPATH
         XMLpath = ""
         # first look in etc
         if os.path.isfile(os.path.join(etcpath,XML_FILENAME)):
@@ -381,15 +1612,15 @@ class database(object):
                 print("No valid writable XML file location found")
                 print("XML file cannot be written, please run as super user")
                 if doexit:
-                    exit(1)
+                    sys.exit(1)
         else: # Only allow etc location
             print("No XML file found")
             if doexit:
-                exit(1)
+                sys.exit(1)
         return XMLpath
 
     def getNewXMLpath(self):
-        etcpath = "/etc/"
+        etcpath = ETCPATH
         XMLpath = ""
         # first look in etc
         if os.path.exists(etcpath):
@@ -398,7 +1629,7 @@ class database(object):
         if (not XMLpath):
             print("No valid writable XML file location found")
             print("XML file cannot be created, please run as super user")
-            exit(1)
+            sys.exit(1)
         return XMLpath
 
 
@@ -410,6 +1641,9 @@ class database(object):
 class swcli(object):
     def __init__(self):
         self.name = ""
+        self.noBlock = False
+        self.ctlTimeout = None
+        self.sharesCache = None
 
     def __del__(self):
         pass
@@ -426,21 +1660,49 @@ class swcli(object):
         else:
             self.name = argv[0]
 
-        self.db = database()
+        self.db = None
+        self.sctl = None
+
+        argv = timer.configure(argv)
+        timer.start(argv[1:])
+        try:
+            self.runCommand(argv)
+        finally:
+            timer.report()
 
+    def runCommand(self, argv):
+        # check options before loading anything
+        argv = self.controlOptions(argv)
         for arg in argv:
             if arg[0] == "-":
                 if arg == "-h" or arg == "--help":
                     self.printHelp()
-                    exit()
+                    sys.exit()
                 elif arg == "-v" or arg == "--version":
                     print(self)
                     print("Version: {}".format(VERSION))
-                    exit()
+                    sys.exit()
                 else:
                     self.parseError(arg)
+        if len(argv) < 2 or not argv[1] in NODBCOMMANDS:
+            with timer.phase("load"):
+                self.db = database()
+        if len(argv) > 1 and argv[1] == "serve":
+            if len(argv) < 3:
+                self.serve()
+            else:
+                self.serve(argv[2])
+        else:
+            self.dispatch(argv)
+
+    def dispatch(self, argv):
         if len(argv) < 2:
             self.lst()
+        elif argv[1] == "lst":
+            if len(argv) < 3:
+                self.lst()
+            else:
+                self.lst(argv[2])
         elif argv[1] == "add":
             opt = argv[1]
             if len(argv) < 3:
@@ -461,13 +1723,57 @@ class swcli(object):
             if len(argv) < 3:
                 opt += " <name>"
                 self.parseError(opt)
-            self.shw(argv[2])
+            self.shw(argv[2:])
         elif argv[1] == "ctl":
             opt = argv[1]
             if len(argv) < 3:
                 opt += " <name>"
                 self.parseError(opt)
-            self.ctl(argv[2])
+            elif argv[2] in ["wait", "job"] and len(argv) < 4:
+                opt += " {} <id>".format(argv[2])
+                self.parseError(opt)
+            self.ctl(argv[2], argv[3] if len(argv) > 3 else "")
+        elif argv[1] == "watch":
+            self.watch()
+        elif argv[1] == "status":
+            self.status()
+        elif argv[1] == "cache":
+            import json
+            print(json.dumps(self.db.cacheStats()))
+        elif argv[1] == "batch":
+            if len(argv) < 3:
+                self.batch()
+            else:
+                self.batch(argv[2])
+        elif argv[1] == "check":
+            self.checkJobs()
+        elif argv[1] == "estimate":
+            self.estimate()
+        elif argv[1] == "settings":
+            if len(argv) < 3:
+                self.settings()
+            else:
+                self.settings(argv[2])
+        elif argv[1] == "shares":
+            if len(argv) < 3:
+                self.shares()
+            else:
+                self.shares(argv[2])
+        elif argv[1] == "stats":
+            if len(argv) < 3:
+                self.stats()
+            else:
+                self.stats(argv[2])
+        elif argv[1] == "export":
+            if len(argv) < 3:
+                self.exportJobs()
+            else:
+                self.exportJobs(argv[2])
+        elif argv[1] == "import":
+            if len(argv) < 3:
+                self.importJobs()
+            else:
+                self.importJobs(argv[2])
         else:
             self.parseError(argv[1])
 
@@ -478,15 +1784,74 @@ class swcli(object):
         print("    <arguments>")
         print("        add           : adds/ edits watch <name> with <json options>")
         print("        del           : deletes watch <name>")
-        print("        shw           : shows options for watch <name>")
+        print("        shw           : shows options for watch <name>, or for all watches matching")
+        print("                        several <name>s or a glob by name")
         print("        ctl           : controls daemon (start, stop, enable, disable, restart,")
         print("                                         reload, isactive, isenabled)")
+        print("                        'ctl job <id>' shows and 'ctl wait <id>' waits for a queued job")
+        print("        batch         : applies a JSON array of operations (or JSON lines from stdin)")
+        print("                        with a single write and a single daemon reload")
+        print("        check         : finds watches writing into folders other watches watch, cycles,")
+        print("                        nested and shared destinations and missing folders, adds and")
+        print("                        imports are not saved on errors")
+        print("        estimate      : counts folders, files and bytes the enabled watches watch and the")
+        print("                        inotify watches needed against fs.inotify.max_user_watches")
+        print("        settings      : shows the settings for all watches, or changes them with <json options>:")
+        print("                        'maxconcurrent' (syncs running at the same time, 0 is no limit)")
+        print("        shares        : lists the Xnas shares in {} and shows for <json options>".format(SHARESPATH))
+        print("                        'paths' (list) if the folders exist and their share")
+        print("        stats         : shows syncs, last success and failure, retries and duration")
+        print("                        percentiles per watch from the daemon journal, filtered by")
+        print("                        <json options> 'name' (glob), or from 'log' (file) instead")
+        print("        export        : writes all watches with their options as JSON (default) or ndjson")
+        print("        import        : adds/ edits watches from an export (or JSON lines from stdin),")
+        print("                        all are validated first and applied with a single write and reload")
+        print("        watch         : keeps running and streams watch and daemon changes as JSON lines")
+        print("        status        : shows daemon state and all watches with folder existence")
+        print("        cache         : shows parsed configuration cache hits and misses")
+        print("        serve         : keeps running and answers JSON-RPC requests on stdin/stdout,")
+        print("                        or on the unix socket <name> if entered")
+        print("        lst           : lists all watches, filtered and paged by <json options>:")
+        print("                        'enabled', 'source' or 'destination' (path prefix), 'name' (glob),")
+        print("                        'fields' (list), 'offset', 'limit' and 'format' (json, ndjson)")
         print("        <no arguments>: lists all watches")
         print("")
         print("JSON options may be entered as single JSON string using full name, e.g.")
         print("{}".format(self.name), end="")
         print(" add sync1 \"{'delete': true}\"")
         print("Mind the double quotes to bind the JSON string.")
+        print("Options:")
+        print("    --timings[=<file>]: reports wall and cpu time per phase as JSON to stderr or <file>")
+        print("                        (or set {} to 1 or <file>)".format(PROFILEENV))
+        print("    --profile=<file>  : dumps cProfile statistics to <file> (or set {})".format(CPROFILEENV))
+        print("    --no-block        : queues daemon start, stop, reload or restart and returns its job id")
+        print("    --timeout=<s>     : overrules the daemon job timeout, 0 is no timeout, defaults:")
+        print("                        {}".format(", ".join("{} {}s".format(k, v) for k, v in CTLTIMEOUTS.items())))
+        print("Watch options besides the syncwatch options are 'priority' ({} to {}, higher syncs".format(PRIORITYMIN, PRIORITYMAX))
+        print("first when more than maxconcurrent syncs are waiting) and 'ioclass' ({})".format(", ".join(IOCLASSES)))
+        print("Batch operations are entered as JSON objects with 'op' (add, edit, del), 'name'")
+        print("and 'options', e.g.")
+        print("{}".format(self.name), end="")
+        print(" batch \"[{'op': 'add', 'name': 'sync1', 'options': {'delete': true}}]\"")
+
+    def controlOptions(self, argv):
+        # daemon control options may be entered anywhere, returns argv without them
+        args = []
+        self.noBlock = False
+        self.ctlTimeout = None
+        for arg in argv:
+            if arg == CTLNOBLOCK:
+                self.noBlock = True
+            elif arg.startswith("--timeout="):
+                try:
+                    self.ctlTimeout = float(arg.split("=", 1)[1])
+                    if self.ctlTimeout < 0:
+                        raise ValueError
+                except ValueError:
+                    self.parseError("Invalid timeout: {}".format(arg))
+            else:
+                args.append(arg)
+        return args
 
     def parseError(self, opt = ""):
         print(self)
@@ -494,76 +1859,1259 @@ class swcli(object):
         if opt:
             print(opt)
         print("Enter '{} -h' for help".format(self.name))
-        exit(1)
+        sys.exit(1)
 
-    def lst(self):
-        dbLst = [] #enabled, source, destination, reversesync
-        for item, value in self.db().items():
+    def lst(self, opt = ""):
+        """Writes the jobs one by one, as JSON array or as JSON lines.
+           Jobs missing a field are listed with the field None and its
+           name in 'missing'.
+        """
+        import json
+        opts = self.parseLst(opt)
+        fields = opts.get('fields', LSTFIELDS)
+        ndjson = opts.get('format') == "ndjson"
+        offset = opts.get('offset', 0)
+        limit = opts.get('limit')
+        count = 0
+        if not ndjson:
+            sys.stdout.write("[")
+        for name, value in self.db().items():
+            if not self.lstMatch(name, value, opts):
+                continue
+            count += 1
+            if count <= offset:
+                continue
+            if limit != None and count > offset + limit:
+                break
+            line = json.dumps(self.lstItem(name, value, fields))
+            if ndjson:
+                sys.stdout.write(line + "\n")
+            elif count > offset + 1:
+                sys.stdout.write(", " + line)
+            else:
+                sys.stdout.write(line)
+        if not ndjson:
+            sys.stdout.write("]\n")
+        sys.stdout.flush()
+
+    def parseLst(self, opt):
+        import json
+        opts = {}
+        if opt:
             try:
-                dbItem = {}
-                dbItem['job'] = item
-                if "enabled" in value: # compatibility with syncwatch 0.8.4
-                    dbItem['enabled'] = value['enabled']
-                else:
-                    dbItem['enabled'] = True
-                dbItem['source'] = value['source']
-                dbItem['destination'] = value['destination']
-                dbItem['reversesync'] = value['reversesync']
-                dbItem['delete'] = value['delete']
-                dbLst.append(dbItem)
+                opts = json.loads(opt)
             except:
-                pass
-        print(json.dumps(dbLst))
+                self.parseError("Invalid JSON format")
+        if not isinstance(opts, dict):
+            self.parseError("Invalid lst options, JSON object expected")
+        for key, value in opts.items():
+            if key == "enabled":
+                valid = type(value) == bool
+            elif key in ["source", "destination", "name"]:
+                valid = type(value) == str
+            elif key == "fields":
+                valid = type(value) == list and all(type(field) == str for field in value)
+            elif key in ["offset", "limit"]:
+                valid = type(value) == int and value >= 0
+            elif key == "format":
+                valid = value in LSTFORMATS
+            else:
+                self.parseError("Invalid lst option: {}".format(key))
+            if not valid:
+                self.parseError("Invalid value for lst option {}: {}".format(key, json.dumps(value)))
+        return opts
+
+    def lstMatch(self, name, value, opts):
+        import fnmatch
+        if 'enabled' in opts and value.get('enabled', True) != opts['enabled']:
+            return False
+        for key in ['source', 'destination']:
+            if key in opts and not self.isPrefix(opts[key], str(value.get(key, ""))):
+                return False
+        if 'name' in opts and not fnmatch.fnmatchcase(name, opts['name']):
+            return False
+        return True
+
+    def isPrefix(self, prefix, path):
+        prefix = prefix.rstrip("/")
+        return path == prefix or path.startswith(prefix + "/")
+
+    def lstItem(self, name, value, fields):
+        dbItem = {}
+        dbItem['job'] = name
+        missing = []
+        for field in fields:
+            if field == "job":
+                continue
+            if field in value:
+                dbItem[field] = value[field]
+            elif field in COMPATFIELDS: # compatibility with syncwatch 0.8.4
+                dbItem[field] = JOBDEFAULTS[field]
+            else:
+                dbItem[field] = None
+                missing.append(field)
+        if missing:
+            dbItem['missing'] = missing
+        return dbItem
+
+    def status(self):
+        import json
+        result = {}
+        result['daemon'] = {}
+        result['jobs'] = []
+        from concurrent.futures import ThreadPoolExecutor
+        paths = set()
+        for value in self.db().values():
+            paths.add(str(value.get('source', "")))
+            paths.add(str(value.get('destination', "")))
+        sctl = self.getSctl()
+        with ThreadPoolExecutor(max_workers = STATUSWORKERS) as pool:
+            active = pool.submit(sctl.isActive, DAEMONSYNCWATCH)
+            enabled = pool.submit(sctl.isEnabled, DAEMONSYNCWATCH)
+            paths = list(paths)
+            exists = dict(zip(paths, pool.map(os.path.isdir, paths)))
+            result['daemon']['active'] = active.result()
+            result['daemon']['enabled'] = enabled.result()
+        result['duplicates'] = self.db.duplicates
+        result['typeerrors'] = self.db.typeErrors
+        for item, value in self.db().items():
+            dbItem = {}
+            dbItem['job'] = item
+            for field in COMPATFIELDS: # compatibility with syncwatch 0.8.4
+                dbItem[field] = JOBDEFAULTS[field]
+            dbItem.update(value)
+            dbItem['sourceexists'] = exists[str(value.get('source', ""))]
+            dbItem['destinationexists'] = exists[str(value.get('destination', ""))]
+            result['jobs'].append(dbItem)
+        print(json.dumps(result))
+
+    def watch(self):
+        """Streams job and daemon changes as JSON lines. The daemon is
+           followed over D-Bus when a GLib main loop is available (python3-gi),
+           otherwise it is polled with the xml.
+        """
+        import select
+        notify = inotify()
+        if not notify.addWatch(ETCPATH, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE):
+            notify.close() # fall back to polling the xml stamp
+        sctl = self.getSctl()
+        jobs = self.copyJobs()
+        daemon = None
+        try:
+            if self.watchSignals(sctl, notify, jobs):
+                return
+            while True:
+                daemon = self.watchDaemon(sctl, daemon)
+                jobs = self.watchJobs(jobs)
+                if notify.available():
+                    readable, writable, failed = select.select([notify], [], [], WATCHPOLL)
+                    if readable:
+                        notify.read()
+                else:
+                    time.sleep(WATCHPOLL)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        finally:
+            notify.close()
+
+    def watchSignals(self, sctl, notify, jobs):
+        try:
+            from gi.repository import GLib
+        except ImportError:
+            return False
+        loop = GLib.MainLoop()
+        state = {"jobs": jobs, "daemon": None}
+        errors = []
+        def guard(func):
+            # exceptions in GLib callbacks are only printed, end the loop instead
+            def call(*args):
+                try:
+                    func()
+                except BaseException as e:
+                    errors.append(e)
+                    loop.quit()
+                return True # keep watching
+            return call
+        def daemonChanged():
+            state['daemon'] = self.watchDaemon(sctl, state['daemon'])
+        def xmlChanged():
+            if notify.available():
+                notify.read()
+            state['jobs'] = self.watchJobs(state['jobs'])
+        daemonChanged = guard(daemonChanged)
+        if not sctl.subscribe(DAEMONSYNCWATCH, daemonChanged):
+            return False
+        if notify.available():
+            GLib.io_add_watch(notify.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, guard(xmlChanged))
+        else:
+            GLib.timeout_add_seconds(WATCHPOLL, guard(xmlChanged))
+        daemonChanged()
+        loop.run()
+        if errors:
+            raise errors[0]
+        return True
+
+    def watchJobs(self, jobs):
+        # a half written xml file must not end the stream, report it and
+        # try again on the next change
+        if not self.db.changed():
+            return jobs
+        import io
+        import contextlib
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                self.db.reload()
+        except SystemExit:
+            self.db.stamp = self.db.getStamp()
+            self.emit({"event": "error", "message": output.getvalue().strip()})
+            return jobs
+        newJobs = self.copyJobs()
+        for event in self.diffJobs(jobs, newJobs):
+            self.emit(event)
+        return newJobs
+
+    def watchDaemon(self, sctl, daemon):
+        state = {}
+        state['event'] = "daemon"
+        state['active'] = sctl.isActive(DAEMONSYNCWATCH)
+        state['enabled'] = sctl.isEnabled(DAEMONSYNCWATCH)
+        if state != daemon:
+            self.emit(state)
+        return state
+
+    def copyJobs(self):
+        return {item: dict(value) for item, value in self.db().items()}
+
+    def diffJobs(self, jobs, newJobs):
+        events = []
+        for item, value in newJobs.items():
+            if not item in jobs:
+                event = {}
+                event['event'] = "added"
+                event['job'] = item
+                event['data'] = value
+                events.append(event)
+            elif value != jobs[item]:
+                event = {}
+                event['event'] = "modified"
+                event['job'] = item
+                event['changes'] = {}
+                for key in sorted(set(value) | set(jobs[item])):
+                    if value.get(key) != jobs[item].get(key):
+                        event['changes'][key] = {"old": jobs[item].get(key), "new": value.get(key)}
+                events.append(event)
+        for item in jobs:
+            if not item in newJobs:
+                event = {}
+                event['event'] = "removed"
+                event['job'] = item
+                events.append(event)
+        return events
+
+    def emit(self, event):
+        import json
+        print(json.dumps(event), flush = True)
 
     def sadd(self, name, opt):
+        import json
+        import re
         opts = {}
         try:
             opts = json.loads(opt)
         except:
             self.parseError("Invalid JSON format")
-        item = self.getItem(name)
+        if not isinstance(opts, dict):
+            self.parseError("Invalid JSON options")
+        error = self.validate(opts)
+        if error:
+            self.parseError(error)
+        if not re.fullmatch(JOBNAME, name.strip()):
+            self.parseError("Invalid <name>")
+        self.db.lock()
+        delta = self.newDelta()
+        item = self.db.getItem(name)
+        prior = dict(item)
         if not item:
             item = self.buildDefault()
-            self.db()[name] = item
-        self.edit(item, opts)
-        if not 'enabled' in item:
-            if not os.path.isdir(item['source']):
-                self.parseError("Source folder does not exist: {}".format(item['source']))
-            elif not os.path.isdir(item['destination']):
-                self.parseError("Destination folder does not exist: {}".format(item['destination']))
-        self.db.update()
-        self.ctl("restart")
+            self.db.setItem(name, item)
+            self.addDelta(delta, "added", name.strip())
+        else:
+            self.addDelta(delta, "modified", self.db.getName(name))
+        with timer.phase("edit"):
+            self.edit(item, opts)
+            error = self.check(item)
+        if error:
+            self.parseError(error)
+        self.addCheck(delta, self.db.getName(name), item, prior)
+        result = {}
+        result['changed'] = not self.sameItem(item, prior)
+        if result['changed']:
+            self.db.setItem(name, item)
+            if self.blocked(delta, result):
+                self.parseError("Not saved, conflicts found:\n{}".format(
+                                "\n".join(self.blockingErrors(result))))
+            self.db.write()
+            result.update(self.apply(delta))
+        else:
+            self.db.unlock()
+            result['result'] = True
+        result['lockwait'] = round(self.db.lockWait, 3)
+        print(json.dumps(result))
 
     def sdel(self, name):
-        item = self.getItem(name)
-        if not item:
+        import json
+        self.db.lock()
+        delta = self.newDelta()
+        name = self.db.getName(name)
+        if not name:
             self.parseError("<name> doesn't exist")
-        del self.db()[name]
-        self.db.update()
-        self.ctl("restart")
+        self.db.delItem(name)
+        self.addDelta(delta, "removed", name)
+        self.db.write()
+        result = self.apply(delta)
+        result['changed'] = True
+        result['lockwait'] = round(self.db.lockWait, 3)
+        print(json.dumps(result))
 
-    def shw(self, name):
-        item = self.getItem(name)
-        if not item:
-            self.parseError("<name> doesn't exist")
-        print(json.dumps(item))
+    def shw(self, names):
+        import json
+        import fnmatch
+        if len(names) == 1 and not any(char in names[0] for char in GLOBCHARS):
+            item = self.db.getItem(names[0])
+            if not item:
+                self.parseError("<name> doesn't exist")
+            print(json.dumps(item))
+            return
+        items = {}
+        for name in names:
+            if any(char in name for char in GLOBCHARS):
+                for key, value in self.db().items():
+                    if fnmatch.fnmatchcase(key, name):
+                        items[key] = value
+            elif self.db.getItem(name):
+                items[self.db.getName(name)] = self.db.getItem(name)
+            else:
+                self.parseError("<name> doesn't exist: {}".format(name))
+        print(json.dumps(items))
 
-    def ctl(self, opt):
+    def exportJobs(self, format = "json"):
+        """Writes the jobs one by one, as {name: options} or as JSON lines
+           {"name": name, "options": options}, both can be imported.
+        """
+        import json
+        if not format in LSTFORMATS:
+            self.parseError("Invalid export format: {}".format(format))
+        ndjson = format == "ndjson"
+        first = True
+        if not ndjson:
+            sys.stdout.write("{")
+        for name, value in self.db().items():
+            if ndjson:
+                sys.stdout.write(json.dumps({"name": name, "options": value}) + "\n")
+            else:
+                sys.stdout.write("{}{}: {}".format("" if first else ", ", json.dumps(name), json.dumps(value)))
+            first = False
+        if not ndjson:
+            sys.stdout.write("}\n")
+        sys.stdout.flush()
+
+    def importJobs(self, opt = ""):
+        import json
+        jobs = []
+        try:
+            if not opt:
+                opt = sys.stdin.read()
+            jobs = self.parseImport(opt)
+        except:
+            self.parseError("Invalid JSON format")
         result = {}
-        sctl = systemdctl()
+        result['jobs'] = len(jobs)
+        result['changed'] = 0
+        result['errors'] = self.validateJobs(jobs)
+        result['action'] = ""
+        result['daemon'] = False
+        if result['errors']:
+            result['result'] = False
+            print(json.dumps(result))
+            return
+        self.db.lock()
+        delta = self.newDelta()
+        for job in jobs:
+            opResult = self.batchOp({"op": "add", "name": job['name'], "options": job['options']}, delta)
+            if opResult.get('error'):
+                result['errors'].append({"name": job['name'], "error": opResult['error']})
+            elif opResult['changed']:
+                result['changed'] += 1
+        blocked = result['changed'] and self.blocked(delta, result)
+        if result['changed'] and not blocked:
+            self.db.write()
+            daemon = self.apply(delta, True)
+            result['action'] = daemon['action']
+            result['daemon'] = daemon['result']
+        else:
+            self.db.unlock()
+        if blocked:
+            result['changed'] = 0
+            errors = self.blockedErrors(result)
+            for name in delta['added'] + delta['modified']:
+                result['errors'].append({"name": name, "error": errors.get(name, BLOCKEDOTHER)})
+        result['result'] = not blocked and not result['errors']
+        result['lockwait'] = round(self.db.lockWait, 3)
+        print(json.dumps(result))
+
+    def parseImport(self, opt):
+        import json
+        opt = opt.strip()
+        try:
+            data = json.loads(opt)
+        except ValueError: # JSON lines
+            data = [json.loads(line) for line in opt.splitlines() if line.strip()]
+        if isinstance(data, dict):
+            if set(data.keys()) == {"name", "options"}: # a single JSON line
+                data = [data]
+            else:
+                data = [{"name": name, "options": options} for name, options in data.items()]
+        if not isinstance(data, list) or not all(isinstance(job, dict) for job in data):
+            raise ValueError("Import jobs must be JSON objects")
+        return data
+
+    def validateJobs(self, jobs):
+        # all jobs at once, before anything is changed
+        import re
+        errors = []
+        for job in jobs:
+            name = job.get('name', "")
+            opts = job.get('options', {})
+            error = ""
+            if not isinstance(name, str) or not re.fullmatch(JOBNAME, name.strip()):
+                error = "Invalid <name>"
+            elif not isinstance(opts, dict):
+                error = "Invalid JSON options"
+            else:
+                error = self.validate(opts)
+                if not error:
+                    item = self.db.getItem(name)
+                    error = self.check(self.edit(dict(item) if item else self.buildDefault(), opts))
+            if error:
+                errors.append({"name": name, "error": error})
+        return errors
+
+    def batch(self, opt = ""):
+        import json
+        ops = []
+        try:
+            if not opt:
+                opt = sys.stdin.read()
+            ops = self.parseBatch(opt)
+        except:
+            self.parseError("Invalid JSON format")
+        self.db.lock()
+        delta = self.newDelta()
+        result = {}
+        result['ops'] = []
+        updated = False
+        for op in ops:
+            opResult = self.batchOp(op, delta)
+            if opResult.get('changed'):
+                updated = True
+            result['ops'].append(opResult)
+        blocked = updated and self.blocked(delta, result)
+        if blocked:
+            self.dropOps(result['ops'], self.blockedErrors(result))
+        if updated and not blocked:
+            self.db.write()
+            daemon = self.apply(delta, True)
+            result['action'] = daemon['action']
+            result['daemon'] = daemon['result']
+        else:
+            self.db.unlock()
+            result['action'] = ""
+            result['daemon'] = False
+        result['result'] = not blocked and all(opResult['result'] for opResult in result['ops'])
+        result['lockwait'] = round(self.db.lockWait, 3)
+        print(json.dumps(result))
+
+    def parseBatch(self, opt):
+        import json
+        opt = opt.strip()
+        if opt.startswith("["):
+            ops = json.loads(opt)
+        else: # JSON lines
+            ops = [json.loads(line) for line in opt.splitlines() if line.strip()]
+        if not all(isinstance(op, dict) for op in ops):
+            raise ValueError("Batch operations must be JSON objects")
+        return ops
+
+    def batchOp(self, op, delta):
+        import re
+        opResult = {}
+        opResult['op'] = op.get('op', "")
+        opResult['name'] = op.get('name', "")
+        opResult['result'] = False
+        opResult['changed'] = False
+        name = opResult['name']
+        opts = op.get('options', {})
+        if not isinstance(name, str) or not re.fullmatch(JOBNAME, name.strip()):
+            opResult['error'] = "Invalid <name>"
+        elif not isinstance(opts, dict):
+            opResult['error'] = "Invalid JSON options"
+        elif opResult['op'] in ["add", "edit"] and self.validate(opts):
+            opResult['error'] = self.validate(opts)
+        elif opResult['op'] == "add" or opResult['op'] == "edit":
+            item = self.db.getItem(name)
+            if not item and opResult['op'] == "edit":
+                opResult['error'] = "<name> doesn't exist"
+            else:
+                with timer.phase("edit"):
+                    newItem = self.edit(dict(item) if item else self.buildDefault(), opts)
+                    error = self.check(newItem)
+                if error:
+                    opResult['error'] = error
+                else:
+                    if item:
+                        opResult['changed'] = not self.sameItem(newItem, item)
+                        if opResult['changed']:
+                            self.addDelta(delta, "modified", self.db.getName(name))
+                            self.addCheck(delta, self.db.getName(name), newItem, item)
+                        item.clear()
+                        item.update(newItem)
+                        if opResult['changed']:
+                            self.db.setItem(name, item)
+                    else:
+                        opResult['changed'] = True
+                        self.addDelta(delta, "added", name.strip())
+                        self.addCheck(delta, name.strip(), newItem, {})
+                        self.db.setItem(name, newItem)
+                    opResult['result'] = True
+        elif opResult['op'] == "del":
+            name = self.db.getName(name)
+            if not name:
+                opResult['error'] = "<name> doesn't exist"
+            else:
+                self.db.delItem(name)
+                self.addDelta(delta, "removed", name)
+                opResult['changed'] = True
+                opResult['result'] = True
+        else:
+            opResult['error'] = "Invalid batch operation: {}".format(opResult['op'])
+        return opResult
+
+    def checkJobs(self):
+        import json
+        result = {}
+        result['findings'] = self.findConflicts()
+        result['errors'] = len([finding for finding in result['findings'] if finding['severity'] == CHECKERROR])
+        result['warnings'] = len(result['findings']) - result['errors']
+        result['result'] = result['errors'] == 0
+        print(json.dumps(result))
+
+    def estimate(self):
+        """Walks the watched trees of all enabled jobs in parallel, every
+           folder needs an inotify watch. Folders with the same mtime as in
+           the last run are not scanned again, so their file counts and
+           bytes are from that run.
+        """
+        import json
+        from concurrent.futures import ThreadPoolExecutor
+        roots = {}
+        for name, value in self.db().items():
+            if value.get('enabled', True):
+                roots[name] = [str(value.get('source', ""))]
+                if self.db.bl(value.get('reversesync', False)):
+                    roots[name].append(str(value.get('destination', "")))
+                roots[name] = [os.path.normpath(path) for path in roots[name] if path]
+        # parents first
+        trees = sorted(set(path for paths in roots.values() for path in paths), key = lambda path: path.split("/"))
+        cache = self.loadEstimate()
+        with ThreadPoolExecutor(max_workers = STATUSWORKERS) as pool:
+            trees = dict(zip(trees, pool.map(lambda path: self.scanTree(path, cache), trees)))
+        newCache = {}
+        for tree in trees.values():
+            newCache.update(tree.pop('entries'))
+        self.saveEstimate(newCache)
+        result = {}
+        result['jobs'] = {}
+        for name, paths in roots.items():
+            job = {"paths": paths, "dirs": 0, "files": 0, "bytes": 0, "errors": 0}
+            for path in paths:
+                for key in ["dirs", "files", "bytes", "errors"]:
+                    job[key] += trees[path][key]
+            job['watches'] = job['dirs']
+            result['jobs'][name] = job
+        # nested trees share their watches
+        result['total'] = {"dirs": 0, "files": 0, "bytes": 0, "errors": 0}
+        counted = pathindex()
+        for path, tree in trees.items():
+            if not counted.overlaps(path):
+                counted.add(path, path)
+                for key in result['total']:
+                    result['total'][key] += tree[key]
+        result['total']['watches'] = result['total']['dirs']
+        result['limit'] = self.maxWatches()
+        result['usage'] = round(result['total']['watches'] / result['limit'], 4) if result['limit'] else None
+        result['exceeds'] = bool(result['limit']) and result['total']['watches'] > result['limit']
+        result['dominant'] = []
+        for name in sorted(roots, key = lambda name: -result['jobs'][name]['watches'])[:ESTIMATETOP]:
+            dominant = {}
+            dominant['job'] = name
+            dominant['watches'] = result['jobs'][name]['watches']
+            dominant['share'] = round(dominant['watches'] / result['total']['watches'], 4) if result['total']['watches'] else 0
+            result['dominant'].append(dominant)
+        result['cache'] = {"hits": sum(tree['hits'] for tree in trees.values()), "misses": sum(tree['misses'] for tree in trees.values())}
+        print(json.dumps(result))
+
+    def scanTree(self, root, cache):
+        tree = {"dirs": 0, "files": 0, "bytes": 0, "errors": 0, "hits": 0, "misses": 0, "entries": {}}
+        folders = [root]
+        while folders:
+            path = folders.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                entry = cache.get(path)
+                if entry and entry[0] == mtime:
+                    tree['hits'] += 1
+                else:
+                    entry = self.scanFolder(path, mtime)
+                    tree['misses'] += 1
+            except OSError:
+                tree['errors'] += 1
+                continue
+            tree['entries'][path] = entry
+            tree['dirs'] += 1
+            tree['files'] += entry[1]
+            tree['bytes'] += entry[2]
+            folders.extend(os.path.join(path, name) for name in entry[3])
+        return tree
+
+    def scanFolder(self, path, mtime):
+        # (mtime, files, bytes, folders), symlinks are not followed
+        files = 0
+        size = 0
+        folders = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks = False):
+                        folders.append(entry.name)
+                    else:
+                        files += 1
+                        size += entry.stat(follow_symlinks = False).st_size
+                except OSError:
+                    pass
+        return mtime, files, size, folders
+
+    def loadEstimate(self):
+        cache = {}
+        try:
+            with open(os.path.join(CACHEPATH, ESTIMATE_FILENAME), "rb") as cache_file:
+                version, entries = marshal.loads(cache_file.read())
+            if version == ESTIMATEVERSION:
+                cache = entries
+        except:
+            pass
+        return cache
+
+    def saveEstimate(self, cache):
+        cachepath = os.path.join(CACHEPATH, ESTIMATE_FILENAME)
+        try:
+            if not os.path.isdir(CACHEPATH):
+                os.makedirs(CACHEPATH)
+            # estimates run unlocked, so every process has its own temporary file
+            tmppath = cachepath + ".{}.tmp".format(os.getpid())
+            with open(tmppath, "wb") as cache_file:
+                marshal.dump((ESTIMATEVERSION, cache), cache_file)
+            os.replace(tmppath, cachepath)
+        except:
+            pass # no write access, scan again next time
+
+    def maxWatches(self):
+        try:
+            with open(MAXWATCHES, "r") as limit_file:
+                return int(limit_file.read())
+        except:
+            return 0
+
+    def settings(self, opt = ""):
+        """Settings are kept outside the jobs in the xml file. Shows all
+           settings, defaults for the ones not in the file, or changes the
+           entered ones and reloads the daemon.
+        """
+        import json
+        opts = {}
+        if opt:
+            try:
+                opts = json.loads(opt)
+            except:
+                self.parseError("Invalid JSON format")
+        if not isinstance(opts, dict):
+            self.parseError("Invalid settings, JSON object expected")
+        for key, value in opts.items():
+            if not key in SETTINGFIELDS:
+                self.parseError("Unknown setting: {}".format(key))
+            if type(value) != SETTINGFIELDS[key] or (key == "maxconcurrent" and value < 0):
+                self.parseError("Invalid value for setting {}: {}".format(key, json.dumps(value)))
+        if not opts:
+            print(json.dumps({key: self.db.getSetting(key) for key in SETTINGDEFAULTS}))
+            return
+        self.db.lock()
+        delta = self.newDelta()
+        for key, value in opts.items():
+            if not key in self.db.settings or self.db.settype(self.db.getSetting(key)) != self.db.settype(value):
+                self.db.setSetting(key, value)
+                self.addDelta(delta, "settings", key)
+        result = {}
+        result['changed'] = len(delta['settings']) > 0
+        if result['changed']:
+            self.db.write()
+            result.update(self.apply(delta))
+        else:
+            self.db.unlock()
+            result['result'] = True
+        result['lockwait'] = round(self.db.lockWait, 3)
+        print(json.dumps(result))
+
+    def shares(self, opt = ""):
+        """Lists the shares and checks the folders the edit dialog needs in
+           one call. The listing is kept until the shares folder changes,
+           which matters in serve mode.
+        """
+        import json
+        opts = self.parseShares(opt)
+        paths = opts.get('paths', [])
+        result = {}
+        result['root'] = SHARESPATH
+        result['shares'] = self.listShares()
+        result['paths'] = {}
+        if len(paths) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers = STATUSWORKERS) as pool:
+                exists = list(pool.map(os.path.isdir, paths))
+        else:
+            exists = [os.path.isdir(path) for path in paths]
+        for path, found in zip(paths, exists):
+            result['paths'][path] = {"exists": found, "safe": self.safeShare(path)}
+        print(json.dumps(result))
+
+    def parseShares(self, opt):
+        import json
+        opts = {}
+        if opt:
+            try:
+                opts = json.loads(opt)
+            except:
+                self.parseError("Invalid JSON format")
+        if not isinstance(opts, dict):
+            self.parseError("Invalid shares options, JSON object expected")
+        for key, value in opts.items():
+            if key != "paths":
+                self.parseError("Invalid shares option: {}".format(key))
+            if type(value) != list or not all(type(path) == str for path in value):
+                self.parseError("Invalid value for shares option {}: {}".format(key, json.dumps(value)))
+        return opts
+
+    def listShares(self):
+        # folders only, symlinks are not shares
+        try:
+            mtime = os.stat(SHARESPATH).st_mtime_ns
+        except OSError:
+            return []
+        if not self.sharesCache or self.sharesCache[0] != mtime:
+            shares = []
+            try:
+                with os.scandir(SHARESPATH) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks = False):
+                                shares.append(entry.name)
+                        except OSError:
+                            pass
+            except OSError:
+                return []
+            self.sharesCache = (mtime, sorted(shares))
+        return list(self.sharesCache[1])
+
+    def safeShare(self, path):
+        # /shares/<share> is referenced by share name, other folders have no share
+        if path.endswith("/"):
+            path = path[:-1]
+        folders = path.split("/")
+        if len(folders) == 3 and folders[0] == "" and "/" + folders[1] == SHARESPATH:
+            return folders[2]
+        return ""
+
+    def stats(self, opt = ""):
+        """Reads the daemon entries logged since the last call and shows the
+           stored statistics. Durations are logged or taken from the sync
+           start, percentiles are over the last STATSSAMPLES syncs.
+        """
+        import json
+        import fnmatch
+        opts = self.parseStats(opt)
+        store = syncstats(opts.get('log', ""))
+        try:
+            read = store.update()
+        except Exception as e:
+            print(json.dumps({"source": store.source, "read": 0, "error": str(e), "result": False}))
+            return
+        result = {}
+        result['source'] = store.source
+        result['read'] = read
+        result['jobs'] = {}
+        for name in store.names():
+            if not 'name' in opts or fnmatch.fnmatchcase(name, opts['name']):
+                result['jobs'][name] = store.query(name)
+        result['result'] = True
+        print(json.dumps(result))
+
+    def parseStats(self, opt):
+        import json
+        opts = {}
+        if opt:
+            try:
+                opts = json.loads(opt)
+            except:
+                self.parseError("Invalid JSON format")
+        if not isinstance(opts, dict):
+            self.parseError("Invalid stats options, JSON object expected")
+        for key, value in opts.items():
+            if not key in ["name", "log"]:
+                self.parseError("Invalid stats option: {}".format(key))
+            if type(value) != str or not value:
+                self.parseError("Invalid value for stats option {}: {}".format(key, json.dumps(value)))
+        return opts
+
+    def blocked(self, delta, result):
+        """Checks the added and modified jobs against all jobs before they
+           are saved. Errors only block when they involve a job with changed
+           CHECKFIELDS, so e.g. a changed delay is saved anyway. On blocking
+           errors the edits are dropped and True is returned.
+        """
+        names = set(delta['added'] + delta['modified'])
+        checks = set(delta['checks'])
+        result['findings'] = [finding for finding in self.findConflicts(names) if names & set(finding['jobs'])]
+        if any(finding['severity'] == CHECKERROR and checks & set(finding['jobs']) for finding in result['findings']):
+            self.db.reload()
+            self.db.unlock()
+            return True
+        return False
+
+    def blockedErrors(self, result):
+        # {name: message} of the jobs in blocking findings
+        errors = {}
+        for message, finding in zip(self.blockingErrors(result), self.blockingFindings(result)):
+            for name in finding['jobs']:
+                errors[name] = errors[name] + "; " + message if name in errors else message
+        return errors
+
+    def blockingErrors(self, result):
+        # one message per blocking finding
+        return ["{}: {} ({})".format(", ".join(finding['jobs']), finding['message'], ", ".join(finding['paths']))
+                for finding in self.blockingFindings(result)]
+
+    def blockingFindings(self, result):
+        return [finding for finding in result['findings'] if finding['severity'] == CHECKERROR]
+
+    def dropOps(self, ops, errors):
+        # the whole batch is not saved, tell why for every operation
+        for opResult in ops:
+            if opResult['result']:
+                opResult['result'] = False
+                opResult['changed'] = False
+                opResult['error'] = errors.get(opResult['name'].strip(), BLOCKEDOTHER)
+
+    def addCheck(self, delta, name, item, prior):
+        # only changes to what findConflicts looks at block saving
+        if any(self.db.settype(item.get(key)) != self.db.settype(prior.get(key)) for key in CHECKFIELDS):
+            if not name in delta['checks']:
+                delta['checks'].append(name)
+
+    def findConflicts(self, names = None):
+        """Findings on the enabled jobs, reversesync jobs also watch their
+           destination and write into their source:
+           self    : source and destination of a job are nested (error)
+           cycle   : jobs writing into each others watched folders (error)
+           feeds   : a job writes into a folder another job watches
+           overlap : jobs write into the same or nested folders
+           missing : folder does not exist
+           Paths are resolved and stat'ed concurrently, only the paths of
+           names if entered, the other paths are compared as entered.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        jobs = {}
+        for name, value in self.db().items():
+            if value.get('enabled', True):
+                jobs[name] = value
+        paths = set()
+        for name, value in jobs.items():
+            if names == None or name in names:
+                paths.add(str(value.get('source', "")))
+                paths.add(str(value.get('destination', "")))
+        paths.discard("")
+        with ThreadPoolExecutor(max_workers = STATUSWORKERS) as pool:
+            paths = list(paths)
+            stats = dict(zip(paths, pool.map(self.statPath, paths)))
+        findings = []
+        watched = pathindex()
+        written = pathindex()
+        targets = {}
+        for name, value in jobs.items():
+            source = self.jobPath(value, 'source', stats)
+            destination = self.jobPath(value, 'destination', stats)
+            for key in ['source', 'destination']:
+                path = str(value.get(key, ""))
+                if path in stats and not stats[path][1]:
+                    findings.append(self.finding(CHECKWARNING, "missing", [name], [path], "{} folder does not exist".format(key.capitalize())))
+            if not source or not destination:
+                continue
+            if self.isPrefix(source, destination) and self.excluded(value, os.path.relpath(destination, source)):
+                pass # the destination is not synced into itself
+            elif self.isPrefix(source, destination) or self.isPrefix(destination, source):
+                findings.append(self.finding(CHECKERROR, "self", [name], [source, destination], "Source and destination are nested"))
+                continue
+            targets[name] = [destination, source] if self.db.bl(value.get('reversesync', False)) else [destination]
+            watched.add(source, name)
+            for target in targets[name]:
+                written.add(target, name)
+            if len(targets[name]) > 1:
+                watched.add(destination, name)
+        edges = {}
+        shared = set()
+        for name, paths in targets.items():
+            edges[name] = {}
+            for target in paths:
+                for other in watched.overlaps(target):
+                    if other != name and not other in edges[name]:
+                        edges[name][other] = target
+                for other in written.overlaps(target):
+                    if other != name:
+                        shared.add(tuple(sorted([name, other])))
+        cycles = self.findCycles(edges)
+        inCycle = {name: i for i, cycle in enumerate(cycles) for name in cycle}
+        for cycle in cycles:
+            paths = sorted(set(edges[name][other] for name in cycle for other in edges[name] if other in cycle))
+            findings.append(self.finding(CHECKERROR, "cycle", sorted(cycle), paths, "Jobs sync into each other endlessly"))
+        for name, others in edges.items():
+            for other, path in others.items():
+                if inCycle.get(name, -1) != inCycle.get(other, -2):
+                    findings.append(self.finding(CHECKWARNING, "feeds", [name, other], [path], "{} writes into a folder {} watches".format(name, other)))
+        for pair in sorted(shared):
+            findings.append(self.finding(CHECKWARNING, "overlap", list(pair), sorted(set(targets[pair[0]] + targets[pair[1]])), "Jobs write into the same folders"))
+        return findings
+
+    def excluded(self, value, relative):
+        # rsync exclude patterns, e.g. backup, /backup or backup/ for the first folder
+        import fnmatch
+        first = relative.split("/")[0]
+        for pattern in str(value.get('exclude', "")).split(","):
+            pattern = pattern.strip().strip("/")
+            if relative != "." and pattern and (fnmatch.fnmatchcase(first, pattern) or fnmatch.fnmatchcase(relative, pattern)):
+                return True
+        return False
+
+    def finding(self, severity, kind, jobs, paths, message):
+        finding = {}
+        finding['severity'] = severity
+        finding['kind'] = kind
+        finding['jobs'] = jobs
+        finding['paths'] = paths
+        finding['message'] = message
+        return finding
+
+    def statPath(self, path):
+        return os.path.realpath(path), os.path.isdir(path)
+
+    def jobPath(self, value, key, stats):
+        path = str(value.get(key, ""))
+        if path in stats:
+            return stats[path][0]
+        return os.path.normpath(path) if path else ""
+
+    def findCycles(self, edges):
+        # jobs in strongly connected components of more than one job (Tarjan)
+        index = {}
+        low = {}
+        stack = []
+        onStack = set()
+        cycles = []
+        for start in edges:
+            if start in index:
+                continue
+            index[start] = low[start] = len(index)
+            stack.append(start)
+            onStack.add(start)
+            work = [(start, iter(edges[start]))]
+            while work:
+                node, kids = work[-1]
+                for kid in kids:
+                    if not kid in index:
+                        index[kid] = low[kid] = len(index)
+                        stack.append(kid)
+                        onStack.add(kid)
+                        work.append((kid, iter(edges.get(kid, {}))))
+                        break
+                    elif kid in onStack:
+                        low[node] = min(low[node], index[kid])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            kid = stack.pop()
+                            onStack.discard(kid)
+                            component.append(kid)
+                            if kid == node:
+                                break
+                        if len(component) > 1:
+                            cycles.append(component)
+        return cycles
+
+    def apply(self, delta, quiet = False):
+        """Reload only the changed jobs when the daemon publishes that it
+           reads the changed job names from the delta file. Otherwise fall
+           back to a full restart, as does a failed reload. A reload that
+           is still running after the timeout is not interrupted. The delta
+           is merged while the xml is still locked, the lock is released
+           before waiting for the daemon.
+        """
+        result = {}
+        sctl = self.getSctl()
+        reload = (sctl.available() and self.deltaReady() and sctl.canReload(DAEMONSYNCWATCH)
+                  and self.writeDelta(delta))
+        if not reload:
+            self.removeDelta()
+        self.db.unlock()
+        if reload:
+            result['action'] = "reload"
+            result.update(self.control("reload"))
+            if result['state'] != "failed":
+                return result
+            self.removeDelta()
+        result['action'] = "restart"
+        if quiet and not sctl.available():
+            result['result'] = False
+        else:
+            result.update(self.control("restart"))
+        return result
+
+    def newDelta(self):
+        # checks: jobs to check before saving, not written for the daemon
+        delta = {kind: [] for kind in DELTAKINDS}
+        delta['checks'] = []
+        return delta
+
+    def addDelta(self, delta, kind, name):
+        if kind == "added":
+            if name in delta['removed']:
+                delta['removed'].remove(name)
+                kind = "modified"
+        elif kind == "modified":
+            if name in delta['added']:
+                return
+        elif kind == "removed":
+            if name in delta['modified']:
+                delta['modified'].remove(name)
+            if name in delta['added']:
+                delta['added'].remove(name)
+                return
+        if not name in delta[kind]:
+            delta[kind].append(name)
+
+    def writeDelta(self, delta):
+        import json
+        # merge with a delta the daemon did not pick up yet
+        deltapath = os.path.join(DELTAPATH, DELTA_FILENAME)
+        merged = {kind: [] for kind in DELTAKINDS}
+        try:
+            with open(deltapath, "r") as delta_file:
+                pending = json.load(delta_file)
+            for kind in DELTAKINDS:
+                for name in pending.get(kind, []):
+                    self.addDelta(merged, kind, name)
+        except:
+            pass
+        for kind in DELTAKINDS:
+            for name in delta[kind]:
+                self.addDelta(merged, kind, name)
+        try:
+            if not os.path.isdir(DELTAPATH):
+                os.makedirs(DELTAPATH)
+            tmppath = deltapath + ".{}.tmp".format(os.getpid())
+            with open(tmppath, "w") as delta_file:
+                json.dump(merged, delta_file)
+            os.replace(tmppath, deltapath)
+        except:
+            return False
+        return True
+
+    def deltaReady(self):
+        return os.path.exists(os.path.join(DELTAPATH, DELTAREADY_FILENAME))
+
+    def removeDelta(self):
+        try:
+            os.remove(os.path.join(DELTAPATH, DELTA_FILENAME))
+        except:
+            pass
+
+    def serve(self, path = ""):
+        if path:
+            import json
+            import socketserver
+            class swhandler(socketserver.StreamRequestHandler):
+                def handle(self):
+                    for line in self.rfile:
+                        line = line.decode(ENCODING)
+                        if line.strip():
+                            response = self.server.cli.handleRequest(line)
+                            self.wfile.write((json.dumps(response) + "\n").encode(ENCODING))
+                            self.wfile.flush()
+
+            if os.path.exists(path):
+                os.remove(path)
+            with socketserver.UnixStreamServer(path, swhandler) as server:
+                os.chmod(path, 0o600)
+                server.cli = self
+                try:
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    os.remove(path)
+        else:
+            try:
+                self.serveStream(sys.stdin, sys.stdout)
+            except KeyboardInterrupt:
+                pass
+
+    def serveStream(self, infile, outfile):
+        import json
+        for line in infile:
+            if line.strip():
+                outfile.write(json.dumps(self.handleRequest(line)) + "\n")
+                outfile.flush()
+
+    def handleRequest(self, line):
+        import json
+        response = {}
+        response['jsonrpc'] = "2.0"
+        response['id'] = None
+        try:
+            request = json.loads(line)
+        except:
+            return self.rpcError(response, RPCPARSEERROR, "Parse error")
+        if not isinstance(request, dict) or not isinstance(request.get('params', []), list):
+            return self.rpcError(response, RPCINVALIDREQ, "Invalid request")
+        response['id'] = request.get('id')
+        method = request.get('method', "")
+        if not method in SERVEMETHODS:
+            return self.rpcError(response, RPCNOMETHOD, "Method not found: {}".format(method))
+        if method in ["batch", "import"] and not any(request.get('params', [])):
+            # stdin is the request stream here
+            return self.rpcError(response, RPCINVALIDREQ, "Missing operations for: {}".format(method))
+        argv = [self.name, method]
+        for param in request.get('params', []):
+            if isinstance(param, str):
+                argv.append(param)
+            else:
+                argv.append(json.dumps(param))
+        retcode, output = self.call(argv)
+        if retcode:
+            return self.rpcError(response, RPCCMDERROR, output.strip())
+        try:
+            if self.ndjsonRequest(argv):
+                # a list, also for a single line
+                response['result'] = [json.loads(line) for line in output.splitlines() if line.strip()]
+            else:
+                response['result'] = json.loads(output)
+        except:
+            try: # JSON lines
+                response['result'] = [json.loads(line) for line in output.splitlines()]
+            except:
+                response['result'] = output.strip()
+        return response
+
+    def ndjsonRequest(self, argv):
+        import json
+        if argv[1] == "export":
+            return "ndjson" in argv[2:]
+        if argv[1] == "lst" and len(argv) > 2:
+            try:
+                return json.loads(argv[2]).get('format') == "ndjson"
+            except:
+                pass
+        return False
+
+    def rpcError(self, response, code, message):
+        response['error'] = {}
+        response['error']['code'] = code
+        response['error']['message'] = message
+        return response
+
+    def call(self, argv):
+        import io
+        import contextlib
+        retcode = 0
+        output = io.StringIO()
+        timer.start(argv[1:])
+        stdin = sys.stdin
+        sys.stdin = io.StringIO() # requests never read the request stream
+        with contextlib.redirect_stdout(output):
+            try:
+                if self.db.changed():
+                    self.db.reload()
+                self.dispatch(self.controlOptions(argv))
+            except SystemExit as e:
+                retcode = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print(e)
+                retcode = 1
+            if retcode:
+                # a failed command may have left edits in memory only
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        self.db.reload()
+                except SystemExit:
+                    # keep serving, but never with a stale config
+                    self.db.stamp = None
+            self.db.unlock()
+        sys.stdin = stdin
+        timer.report()
+        return retcode, output.getvalue()
+
+    def getSctl(self):
+        if not self.sctl:
+            self.sctl = systemdbus()
+            if not self.sctl.available():
+                self.sctl = systemdctl()
+        return self.sctl
+
+    def ctl(self, opt, job = ""):
+        import json
+        print(json.dumps(self.control(opt, job)))
+
+    def control(self, opt, job = ""):
+        result = {}
+        sctl = self.getSctl()
         if not sctl.available():
             print("Reason: systemd unavailable on your distro")
             print("{} cannot automatically restart the {} service".format(self.name, DAEMONSYNCWATCH))
             print("You can try it yourself using a command like 'service {} restart'".format(DAEMONSYNCWATCH))
             self.parseError()
-        if opt == "start":
-            result['result'] = sctl.start(DAEMONSYNCWATCH)
-        elif opt == "stop":
-            result['result'] = sctl.stop(DAEMONSYNCWATCH)
-        elif opt == "restart":
-            result['result'] = sctl.restart(DAEMONSYNCWATCH)
-        elif opt == "reload":
-            result['result'] = sctl.reload(DAEMONSYNCWATCH)
+        if opt in CTLJOBS:
+            result.update(sctl.submit(opt, DAEMONSYNCWATCH, self.getTimeout(opt), not self.noBlock))
+            result['timeout'] = self.getTimeout(opt)
+        elif opt == "wait" or opt == "job":
+            result['job'] = self.parseJob(job)
+            if opt == "wait":
+                result['state'] = sctl.wait(result['job'], self.getTimeout(opt))
+                result['timeout'] = self.getTimeout(opt)
+            else:
+                result['state'] = sctl.jobState(result['job'])
+            result['result'] = result['state'] == "done"
+            result['active'] = sctl.isActive(DAEMONSYNCWATCH)
         elif opt == "enable":
             result['result'] = sctl.enable(DAEMONSYNCWATCH)
         elif opt == "disable":
@@ -574,35 +3122,64 @@ class swcli(object):
             result['result'] = sctl.isEnabled(DAEMONSYNCWATCH)
         else:
             self.parseError("Invalid ctl option: {}".format(opt))
-        print(json.dumps(result))
+        return result
 
-    def getItem(self, name):
-        itemvals = {}
-
-        for item, value in self.db().items():
-            if name.strip() == item.strip():
-                itemvals = value
-                break
+    def getTimeout(self, opt):
+        # 0 is no timeout
+        if self.ctlTimeout != None:
+            return self.ctlTimeout
+        return CTLTIMEOUTS.get(opt, 0)
 
-        return itemvals
+    def parseJob(self, job):
+        try:
+            return int(job)
+        except ValueError:
+            self.parseError("Invalid job id: {}".format(job))
 
     def buildDefault(self):
-        item = {}
-        item['enabled'] = True
-        item['source'] = ""
-        item['destination'] = ""
-        item['delay'] = 10
-        item['resettimer'] = True
-        item['initsync'] = False
-        item['reversesync'] = False
-        item['retry'] = False
-        item['delete'] = True
-        item['exclude'] = ""
-        item['include'] = ""
-        item['compress'] = True
-        item['update'] = True
-        item['options'] = ""
-        return item
+        return dict(JOBDEFAULTS)
+
+    def sameItem(self, item, prior):
+        # compare as written to xml, so e.g. 1 and "1" are equal
+        if item.keys() != prior.keys():
+            return False
+        for key, value in item.items():
+            if self.db.settype(value) != self.db.settype(prior[key]):
+                return False
+        return True
+
+    def validate(self, opts):
+        # options edit would skip silently
+        error = ""
+        for key, value in opts.items():
+            kind = JOBFIELDS.get(key)
+            if kind == None:
+                error = "Unknown option: {}".format(key)
+            elif kind is bool:
+                if not type(value) in [bool, int] and not (type(value) == str and value.lower() in BOOLTRUE + BOOLFALSE):
+                    error = "Invalid value for {}: bool expected".format(key)
+            elif type(value) != kind:
+                error = "Invalid value for {}: {} expected".format(key, kind.__name__)
+            if error:
+                break
+        return error
+
+    def check(self, item):
+        error = ""
+        if not 'enabled' in item:
+            # jobs written by hand may miss a folder
+            source = str(item.get('source', ""))
+            destination = str(item.get('destination', ""))
+            if not os.path.isdir(source):
+                error = "Source folder does not exist: {}".format(source)
+            elif not os.path.isdir(destination):
+                error = "Destination folder does not exist: {}".format(destination)
+        if not error and 'priority' in item and (type(item['priority']) != int or
+                                                 not PRIORITYMIN <= item['priority'] <= PRIORITYMAX):
+            error = "Invalid priority: {}, {} to {} expected".format(item['priority'], PRIORITYMIN, PRIORITYMAX)
+        if not error and 'ioclass' in item and not item['ioclass'] in IOCLASSES:
+            error = "Invalid ioclass: {}, {} expected".format(item['ioclass'], ", ".join(IOCLASSES))
+        return error
 
     def edit(self, item, opts):
         if 'enabled' in opts:
@@ -633,6 +3210,10 @@ class swcli(object):
             item['update'] = self.db.bl(opts['update'])
         if 'options' in opts and type(opts['options']) == str:
             item['options'] = opts['options']
+        if 'priority' in opts and type(opts['priority']) == int:
+            item['priority'] = opts['priority']
+        if 'ioclass' in opts and type(opts['ioclass']) == str:
+            item['ioclass'] = opts['ioclass']
         return item
 
 ######################### MAIN ##########################
@@ -20,6 +20,7 @@ class syncJobs {
             {name : "Delete", disable: null, disableValue: null, callback: this.delete}
         ];
         this.jobs = [];
+        this.jobData = {};
         this.hasXnas = false;
     }
 
@@ -40,20 +41,91 @@ class syncJobs {
 
     getJobs() {
         var cb = function(data) {
-            var tData = JSON.parse(data);
-            var lData = [];
-            this.jobs = [];
+            var sData = JSON.parse(data);
+            var tData = ("jobs" in sData) ? sData.jobs : [];
+            this.jobData = {};
             tData.forEach(datum => {
-                this.jobs.push(datum.job);
-                if (this.isSafe(datum.source, datum.destination)) {
-                    datum.source = "Xshare:" + this.folder2safe(datum.source);
-                    datum.destination = "Xshare:" + this.folder2safe(datum.destination);
+                this.jobData[datum.job] = Object.assign({}, datum);
+            });
+            this.renderJobs();
+            this.watchJobs();
+        }
+        runCmd.call(this, cb, ["status"]);
+    }
+
+    renderJobs() {
+        var lData = [];
+        this.jobs = [];
+        for (let job in this.jobData) {
+            let datum = this.jobData[job];
+            this.jobs.push(datum.job);
+            var lDatum = {
+                job: datum.job,
+                enabled: datum.enabled,
+                source: datum.source,
+                destination: datum.destination,
+                reversesync: datum.reversesync,
+                delete: datum.delete
+            };
+            if (this.isSafe(datum.source, datum.destination)) {
+                lDatum.source = "Xshare:" + this.folder2safe(datum.source);
+                lDatum.destination = "Xshare:" + this.folder2safe(datum.destination);
+            }
+            lData.push(lDatum);
+        }
+        this.pane.getTable().setData(lData);
+    }
+
+    watchJobs() {
+        // follow changes made elsewhere instead of polling the list
+        var buffer = "";
+        var cbStream = function(data) {
+            var lines = (buffer + data).split("\n");
+            var changed = false;
+            buffer = lines.pop();
+            lines.forEach(line => {
+                var event = null;
+                try {
+                    event = JSON.parse(line);
+                } catch (e) {
+                    return;
+                }
+                if (event.event == "added") {
+                    this.jobData[event.job] = Object.assign({job: event.job}, event.data);
+                    changed = true;
+                } else if ((event.event == "modified") && (event.job in this.jobData)) {
+                    for (let key in event.changes) {
+                        this.jobData[event.job][key] = event.changes[key].new;
+                    }
+                    changed = true;
+                } else if (event.event == "removed") {
+                    delete this.jobData[event.job];
+                    changed = true;
                 }
-                lData.push(datum);
+                // on an "error" event (xml file being written) the last jobs stay shown
             });
-            this.pane.getTable().setData(lData);
+            if (changed) {
+                this.renderJobs();
+            }
+        };
+        if (swWatcher) {
+            swWatcher.close();
         }
-        runCmd.call(this, cb);
+        var watcher = cockpit.spawn([swServer.cmd, "watch"], { superuser: "require" });
+        var cbEnd = function() {
+            // restart when watch ended by itself, reload the jobs changed meanwhile
+            if (swWatcher === watcher) {
+                swWatcher = null;
+                setTimeout(function () {
+                    if (!swWatcher) {
+                        this.getJobs();
+                    }
+                }.bind(this), 10000);
+            }
+        };
+        swWatcher = watcher;
+        swWatcher.stream(cbStream.bind(this));
+        swWatcher.always(cbEnd.bind(this));
     }
 
     addJob() {
@@ -87,8 +159,15 @@ class syncJobs {
             this.pane.disposeSpinner();
             this.buildEditDialog(data.job, aData);
         }
-        this.pane.showSpinner();
-        runCmd.call(this, cbEdit, ["shw", data.job]);
+        if (data.job in this.jobData) {
+            // all job data is already loaded by status
+            var aData = Object.assign({}, this.jobData[data.job]);
+            ["job", "sourceexists", "destinationexists"].forEach(key => delete aData[key]);
+            cbEdit.call(this, JSON.stringify(aData));
+        } else {
+            this.pane.showSpinner();
+            runCmd.call(this, cbEdit, ["shw", data.job]);
+        }
     }
 
     buildEditDialog(name, aData) {
@@ -480,8 +559,11 @@ class syncJobs {
         } else {
             safeEnable = this.isSafe(aData.source, aData.destination);
         }
-        this.folderExists(aData.source, sourceValidCallback);
-        this.folderExists(aData.destination, destinationValidCallback);
+        var foldersValidCallback = function(exists) {
+            sourceValidCallback.call(this, exists[aData.source]);
+            destinationValidCallback.call(this, exists[aData.destination]);
+        }
+        this.foldersExist([aData.source, aData.destination], foldersValidCallback);
         safesyncChangedCallback.call(this, null, safeEnable);
     }
 
@@ -503,49 +585,48 @@ class syncJobs {
     }
 
     getXshares(callback) {
-        // read /shares folder contents
-        var command = ["/usr/bin/ls", "-1", "--classify", "--color=never", "/shares"];
-        var cbDone = function(rData) {
-            var aData = rData.split("\n");
-            aData = aData.filter(n => n);
-            aData = aData.filter(n => (n.slice(-1) == "/"));
-            var bData = [];
-            aData.forEach(n => {
-                if (n.endsWith("/")) {
-                    n = n.slice(0,-1);
-                }
-                bData.push(n);
-            });
-            if (callback) {
-                callback.call(this, bData);
+        // read /shares folder contents, cached by the cli until /shares changes
+        var cbDone = function(data) {
+            var sData = {};
+            try {
+                sData = JSON.parse(data);
+            } catch (e) {
+                sData = {};
             }
-        };
-        var cbFail = function(message, rData) {
-            var aData = [];
             if (callback) {
-                callback.call(this, aData);
+                callback.call(this, ("shares" in sData) ? sData.shares : []);
             }
         };
-        return cockpit.spawn(command, { err: "out" })
-        .done(cbDone.bind(this))
-        .fail(cbFail.bind(this));
+        runCmd.call(this, cbDone, ["shares"]);
     }
 
     folderExists(folder, callback) {
-        var command = ["/usr/bin/test", "-d", folder];
-        var cbDone = function(rData) {
+        var cbDone = function(exists) {
             if (callback) {
-                callback.call(this, true);
+                callback.call(this, exists[folder]);
             }
         };
-        var cbFail = function(message, rData) {
+        this.foldersExist([folder], cbDone);
+    }
+
+    foldersExist(folders, callback) {
+        // all folders in one cli call
+        var cbDone = function(data) {
+            var sData = {};
+            try {
+                sData = JSON.parse(data);
+            } catch (e) {
+                sData = {};
+            }
+            var exists = {};
+            folders.forEach(folder => {
+                exists[folder] = (("paths" in sData) && (folder in sData.paths)) ? sData.paths[folder].exists : false;
+            });
             if (callback) {
-                callback.call(this, false);
+                callback.call(this, exists);
             }
         };
-        return cockpit.spawn(command, { err: "out" })
-        .done(cbDone.bind(this))
-        .fail(cbFail.bind(this));
+        runCmd.call(this, cbDone, ["shares"], {"paths": folders});
     }
 
     isSafe(source, destination) {
@@ -588,7 +669,7 @@ class syncJobs {
             } else {
                 var cbYes = function() {
                     this.pane.showSpinner("Adding/ editing...");
-                    runCmd.call(this, this.displayContent, ["add", name], opts);
+                    runCmd.call(this, this.displayContent, ["add", name, "--no-block"], opts);
                 };
                 var txt = "";
                 if (addJob) {
@@ -606,7 +687,7 @@ class syncJobs {
     enable(data) {
         var cbYes = function() {
             this.pane.showSpinner("Enabling...");
-            runCmd.call(this, this.getJobs, ["add", data.job], {"enabled": true});
+            runCmd.call(this, this.getJobs, ["add", data.job, "--no-block"], {"enabled": true});
         };
         var txt = "Are you sure to enable " + data.job + "?" + "<br>" +
                     "This item will automatically sync!"
@@ -616,7 +697,7 @@ class syncJobs {
     disable(data) {
         var cbYes = function() {
             this.pane.showSpinner("Disabling...");
-            runCmd.call(this, this.getJobs, ["add", data.job], {"enabled": false});
+            runCmd.call(this, this.getJobs, ["add", data.job, "--no-block"], {"enabled": false});
         };
         var txt = "Are you sure to disable " + data.job + "?" + "<br>" +
                     "This item will not automatically sync anymore!"
@@ -626,7 +707,7 @@ class syncJobs {
     delete(data) {
         var cbYes = function() {
             this.pane.showSpinner("Deleting...");
-            runCmd.call(this, this.getJobs, ["del", data.job]);
+            runCmd.call(this, this.getJobs, ["del", data.job, "--no-block"]);
         };
         var txt = "Are you sure to delete " + data.job + "?" + "<br>" +
                     "This item will be deleted from database!";
@@ -638,6 +719,71 @@ class syncJobs {
 // Common functions //
 //////////////////////
 
+class cliServer {
+    constructor(cmd = "/opt/syncwatch/syncwatch-cli.py") {
+        this.cmd = cmd;
+        this.proc = null;
+        this.failed = false;
+        this.buffer = "";
+        this.id = 0;
+        this.pending = {};
+    }
+
+    available() {
+        if ((!this.proc) && (!this.failed)) {
+            this.start();
+        }
+        return !this.failed;
+    }
+
+    start() {
+        this.proc = cockpit.spawn([this.cmd, "serve"], { superuser: "require" });
+        this.proc.stream(this.receive.bind(this));
+        this.proc.always(this.stop.bind(this));
+    }
+
+    stop() {
+        // serve not available or terminated, retry pending requests by spawning the cli
+        this.proc = null;
+        this.failed = true;
+        for (let id in this.pending) {
+            this.pending[id].retry();
+        }
+        this.pending = {};
+    }
+
+    call(method, params, done, fail, retry) {
+        this.id++;
+        this.pending[this.id] = {done: done, fail: fail, retry: retry};
+        this.proc.input(JSON.stringify({jsonrpc: "2.0", id: this.id, method: method, params: params}) + "\n", true);
+    }
+
+    receive(data) {
+        var lines = (this.buffer + data).split("\n");
+        this.buffer = lines.pop();
+        lines.forEach(line => {
+            var response = null;
+            try {
+                response = JSON.parse(line);
+            } catch (e) {
+                return; // not a response, e.g. initial xml creation message
+            }
+            if ((response) && (response.id in this.pending)) {
+                var request = this.pending[response.id];
+                delete this.pending[response.id];
+                if ("error" in response) {
+                    request.fail(response.error.message);
+                } else {
+                    request.done(JSON.stringify(response.result));
+                }
+            }
+        });
+    }
+}
+
+var swServer = new cliServer();
+var swWatcher = null;
+
 function runCmd(callback, args = [], json = null, cmd = "/opt/syncwatch/syncwatch-cli.py") {
     var cbDone = function(data) {
         callback.call(this, data);
@@ -646,6 +792,17 @@ function runCmd(callback, args = [], json = null, cmd = "/opt/syncwatch/syncwatc
         callback.call(this, "[]");
         new msgBox(this, "Syncwatch command failed", "Command error: " + (data ? data : message + "<br>Please check the log file"));
     };
+    if ((cmd == swServer.cmd) && (swServer.available())) {
+        var params = args.slice(1);
+        if (json) {
+            params.push(json);
+        }
+        var cbRetry = function() {
+            runCmd.call(this, callback, args, json, cmd);
+        };
+        swServer.call((args.length > 0) ? args[0] : "lst", params, cbDone.bind(this), cbFail.bind(this), cbRetry.bind(this));
+        return;
+    }
     var command = [cmd];
     command = command.concat(args);
     if (json) {